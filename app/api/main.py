@@ -11,9 +11,18 @@ from pydantic import BaseModel #type:ignore
 from typing import List, Optional
 import json
 import time
-from app.core.filter import ImageFilter
+import asyncio
+import itertools
+import zipfile
+import tarfile
+import threading
+from app.core.executor import BoundedExecutor, QueueFullError
+from app.core.archive import is_archive, iter_archive_images
+from app.core import metrics
+import mimetypes
 from app.core.config import API_KEYS #type:ignore
 from fastapi.security.api_key import APIKeyHeader  #type:ignore
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse #type:ignore
 from starlette.status import HTTP_403_FORBIDDEN  #type:ignore
 from dotenv import load_dotenv #type:ignore
 load_dotenv(env_path)
@@ -26,7 +35,67 @@ MINIO_CONFIG = {
     "secure": False # Đặt True nếu link là https:// , False nếu là http://
 }
 MODEL_PATH = os.getenv("MODEL_PATH")
+# Backend inference: ultralytics (mặc định) / onnxruntime / openvino (2 loại sau cần MODEL_PATH là file .onnx)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "ultralytics")
+# Thiết bị: auto (GPU nếu có, không thì CPU) / cpu / 0, 1... ; ONNX_INT8=1 để lượng tử hóa INT8 khi chạy CPU
+DEVICE = os.getenv("DEVICE", "auto")
+BACKEND_OPTIONS = {"int8": True} if os.getenv("ONNX_INT8", "0") == "1" else {}
+# Số process inference riêng (ảnh truyền qua shared memory). 0 = chạy model ngay trong process API
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
 MONGO_URI = os.getenv("MONGO_URI")
+# Micro-batching: gom ảnh từ các request đồng thời vào 1 lần gọi model (BATCH_MAX_SIZE=1 để tắt)
+BATCH_CONFIG = {
+    "max_batch_size": int(os.getenv("BATCH_MAX_SIZE", "8")),
+    "max_wait_ms": float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+}
+# Thread pool cho decode/inference/lưu trữ, tránh chặn event loop của uvicorn
+FILTER_WORKERS = int(os.getenv("FILTER_WORKERS", "16"))
+FILTER_MAX_PENDING = int(os.getenv("FILTER_MAX_PENDING", "64"))
+# Số ảnh tối đa trong 1 request /v1/filter/batch (tính cả ảnh trong file zip/tar)
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+# Số ảnh tối đa trong 1 request /v1/filter/batch/stream (0 = không giới hạn)
+BATCH_STREAM_MAX_FILES = int(os.getenv("BATCH_STREAM_MAX_FILES", "10000"))
+# Kích thước tối đa (MB, sau giải nén) của 1 ảnh trong file zip/tar, ảnh lớn hơn bị bỏ qua (0 = không giới hạn)
+ARCHIVE_MAX_IMAGE_BYTES = int(float(os.getenv("ARCHIVE_MAX_IMAGE_MB", "50")) * 1024 * 1024)
+# Cache kết quả theo nội dung ảnh (RESULT_CACHE_SIZE=0 để tắt, RESULT_CACHE_SHARED=1 để dùng chung qua MongoDB)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+CACHE_CONFIG = {
+    "max_items": RESULT_CACHE_SIZE,
+    "ttl": float(os.getenv("RESULT_CACHE_TTL", "3600")),
+    "shared_collection": "result_cache" if os.getenv("RESULT_CACHE_SHARED", "0") == "1" else None
+}
+# Nhận diện ảnh gần trùng (đã resize / nén lại) bằng perceptual hash, DEDUP_ENABLED=1 để bật
+DEDUP_CONFIG = {
+    "threshold": int(os.getenv("DEDUP_MAX_DISTANCE", "6")),
+    "max_items": int(os.getenv("DEDUP_MAX_ITEMS", "50000"))
+} if os.getenv("DEDUP_ENABLED", "0") == "1" else None
+# Decode JPEG lớn ở 1/2, 1/4, 1/8 độ phân giải khi vẫn đủ cho model (REDUCED_DECODE=0 để luôn decode đủ)
+REDUCED_DECODE = os.getenv("REDUCED_DECODE", "1") == "1"
+# Chế độ decision-only (chỉ trả KEEP/SKIP, không kèm detections): mặc định cho các user trong DECISION_MODE_USERS,
+# hoặc chọn theo từng request bằng field mode=decision / mode=full
+DECISION_MODE_USERS = {u.strip() for u in os.getenv("DECISION_MODE_USERS", "").split(",") if u.strip()}
+DECISION_CONFIG = {
+    "conf": float(os.getenv("DECISION_CONF", "0.25")),
+    "max_det": int(os.getenv("DECISION_MAX_DET", "10"))
+}
+# Cascade lọc trước (CASCADE_ENABLED=1): classifier ONNX nhỏ + heuristic ảnh trống / tài liệu (CASCADE_HEURISTICS=1)
+CASCADE_CONFIG = {
+    "heuristics": os.getenv("CASCADE_HEURISTICS", "0") == "1",
+    "classifier_path": os.getenv("CASCADE_CLASSIFIER_PATH") or None,
+    "reject_below": float(os.getenv("CASCADE_REJECT_BELOW", "0.05")),
+    "reject_action": os.getenv("CASCADE_REJECT_ACTION", "SKIP")
+} if os.getenv("CASCADE_ENABLED", "0") == "1" else None
+# Suy luận theo tile cho ảnh lớn (TILING_ENABLED=1): ảnh có cạnh dài >= TILE_MIN_SIDE được cắt tối đa TILE_MAX tile
+TILING_CONFIG = {
+    "tile_size": int(os.getenv("TILE_SIZE", "640")),
+    "min_side": int(os.getenv("TILE_MIN_SIDE", "1600")),
+    "max_tiles": int(os.getenv("TILE_MAX", "8"))
+} if os.getenv("TILING_ENABLED", "0") == "1" else None
+# Khởi tạo chạy nền: thử lại tối đa INIT_MAX_RETRIES lần, thời gian chờ tăng dần tới INIT_MAX_BACKOFF giây
+INIT_MAX_RETRIES = int(os.getenv("INIT_MAX_RETRIES", "10"))
+INIT_MAX_BACKOFF = float(os.getenv("INIT_MAX_BACKOFF", "30"))
+# Chạy thử model trên ảnh đen trước khi báo sẵn sàng (MODEL_WARMUP=0 để tắt)
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
 DB_NAME = "api_request_log"
 COLLECTION_NAME = "test_confidence_0.1"
 TARGET_CLASSES = ["smartphone", "pen", "note paper","t-shirt","smartwatch","glasses","bracelet","dishwasher","cabinet","sofa","box cutter","shoes","table","scissor","paper"]
@@ -85,15 +154,42 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
         )
 # Biến toàn cục để lưu instance của filter
 filter_tool = None 
+filter_executor = BoundedExecutor(max_workers=FILTER_WORKERS, max_pending=FILTER_MAX_PENDING)
+metrics.QUEUE_DEPTH.set_function(lambda: filter_executor.depth, queue="executor")
 
-@app.on_event("startup") # Khi server khởi động chạy hàm này ngay lập tức
-def startup_event():
-    """Hàm chạy 1 lần khi server khởi động để load Model"""
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    """Đo thời gian mỗi request theo route (chỉ tới lúc trả header với response dạng stream)"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    if route is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=route.path)
+    return response
+
+def register_queue_gauges(tool):
+    """Độ dài các hàng đợi nền của filter, đọc lúc Prometheus scrape"""
+    if tool.batcher:
+        metrics.QUEUE_DEPTH.set_function(lambda: tool.batcher.depth, queue="batcher")
+    if tool.uploader:
+        metrics.QUEUE_DEPTH.set_function(lambda: tool.uploader.depth, queue="minio_upload")
+    if tool.log_writer:
+        metrics.QUEUE_DEPTH.set_function(lambda: tool.log_writer.depth, queue="mongo_log")
+
+# Trạng thái khởi tạo, dùng cho /readyz
+service_state = {"status": "starting", "attempts": 0, "error": None, "startup_seconds": None}
+
+def init_filter_tool():
+    """Chạy ở luồng nền: import thư viện nặng, kết nối Database/MinIO và load model, lỗi thì thử lại"""
     global filter_tool
-    max_retries = 10  # Thử tối đa 10 lần
-    for i in range(max_retries):
+    started = time.monotonic()
+    # Import ở đây (không để đầu file) để uvicorn mở port ngay, không chờ cv2 / runtime model
+    from app.core.filter import ImageFilter
+    delay = 1.0
+    for i in range(INIT_MAX_RETRIES):
+        service_state["attempts"] = i + 1
         try:
-            print(f"🔄 Đang thử kết nối Database và Load Model (Lần {i+1}/{max_retries})...")
+            print(f"🔄 Đang thử kết nối Database và Load Model (Lần {i+1}/{INIT_MAX_RETRIES})...")
             filter_tool = ImageFilter(
                 model_path=MODEL_PATH,
                 mongo_uri=MONGO_URI,
@@ -102,25 +198,87 @@ def startup_event():
                 target_classes=TARGET_CLASSES,
                 minio_config=MINIO_CONFIG,
                 enable_filter=True,
-                device=0,
-                class_mapping=CLASS_MAPPING
+                device=DEVICE,
+                class_mapping=CLASS_MAPPING,
+                batch_config=BATCH_CONFIG if BATCH_CONFIG["max_batch_size"] > 1 else None,
+                cache_config=CACHE_CONFIG if RESULT_CACHE_SIZE > 0 else None,
+                dedup_config=DEDUP_CONFIG,
+                backend=INFERENCE_BACKEND,
+                backend_options=BACKEND_OPTIONS,
+                worker_config={"num_workers": INFERENCE_WORKERS} if INFERENCE_WORKERS > 0 else None,
+                warmup=MODEL_WARMUP,
+                reduced_decode=REDUCED_DECODE,
+                decision_config=DECISION_CONFIG,
+                cascade_config=CASCADE_CONFIG,
+                tiling_config=TILING_CONFIG
             )
-            print("✅ KẾT NỐI THÀNH CÔNG! AI Service đã sẵn sàng.")
-            break # Thoát vòng lặp nếu thành công
-            
+            register_queue_gauges(filter_tool)
+            service_state.update(status="ready", error=None, startup_seconds=round(time.monotonic() - started, 2))
+            print(f"✅ KẾT NỐI THÀNH CÔNG! AI Service đã sẵn sàng sau {service_state['startup_seconds']}s.")
+            return
+
         except Exception as e:
+            service_state["error"] = str(e)
             print(f"⚠️ Lỗi khởi tạo (Lần {i+1}): {e}")
-            print("⏳ Đợi 5 giây rồi thử lại...")
-            time.sleep(5) # Ngủ 5 giây chờ Mongo khởi động xong
+            if i + 1 < INIT_MAX_RETRIES:
+                print(f"⏳ Đợi {delay:.0f} giây rồi thử lại...")
+                time.sleep(delay) # Chờ Mongo / MinIO khởi động xong
+                delay = min(delay * 2, INIT_MAX_BACKOFF)
+    service_state["status"] = "failed"
+    print(f"[ERROR] ❌ Không khởi tạo được AI Service sau {INIT_MAX_RETRIES} lần thử")
+
+@app.on_event("startup") # Khi server khởi động chạy hàm này ngay lập tức
+def startup_event():
+    """Khởi tạo filter ở luồng nền, server nhận request ngay (/healthz sống, /readyz báo khi nào sẵn sàng)"""
+    threading.Thread(target=init_filter_tool, name="filter-init", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Dừng các worker nền của filter khi server tắt"""
+    filter_executor.shutdown(wait=True)
+    if filter_tool:
+        filter_tool.close()
 
 @app.get("/") # Kích hoạt khi người dùng vào link với endpoint "/"
 def health_check():
-    return {"status": "ok", "service": "Image Filter API"}
+    return {"status": "ok", "service": "Image Filter API", "ready": filter_tool is not None}
+
+@app.get("/healthz")
+def liveness():
+    """Liveness: process còn sống và event loop còn phản hồi"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readiness():
+    """Readiness: chỉ trả 200 khi model và các kết nối đã sẵn sàng nhận request"""
+    if filter_tool is None:
+        return JSONResponse(status_code=503, content=service_state)
+    return service_state
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Metric theo định dạng Prometheus: latency từng bước, số ảnh theo action / user / source, độ dài hàng đợi"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/v1/stats")
+def get_service_stats(user_name: str = Depends(get_api_key)):
+    """Thống kê nhanh: số ảnh theo nhãn target, cache, hàng đợi xử lý"""
+    if not filter_tool:
+        raise HTTPException(status_code=503, detail="AI Service chưa sẵn sàng")
+    return {
+        "labels": filter_tool.get_stats(),
+        "cache": filter_tool.result_cache.get_stats() if filter_tool.result_cache else None,
+        "near_duplicates": filter_tool.dedup_index.get_stats() if filter_tool.dedup_index else None,
+        "cascade": filter_tool.cascade.get_stats() if filter_tool.cascade else None,
+        "tiling": filter_tool.tiling.stats if filter_tool.tiling else None,
+        "executor": {"depth": filter_executor.depth, "rejected": filter_executor.rejected}
+    }
 
 @app.post("/v1/filter")
 async def filter_image(
     file: UploadFile = File(...), 
     source: Optional[str] = Form("unknown"),
+    mode: Optional[str] = Form(None),
     user_name: str = Depends(get_api_key)
 ):
     """
@@ -128,14 +286,19 @@ async def filter_image(
     
     - **file**: File ảnh upload (binary)
     - **source**: Nguồn gốc ảnh (tùy chọn, ví dụ: 'team_marketing', 'crawler_bot')
+    - **mode**: 'full' (mặc định) hoặc 'decision' (chỉ trả is_valid/action/nhãn target, nhanh hơn)
     """
     if not filter_tool:
         raise HTTPException(status_code=503, detail="AI Service chưa sẵn sàng")
+    mode = mode or ("decision" if user_name in DECISION_MODE_USERS else "full")
+    if mode not in ("full", "decision"):
+        raise HTTPException(status_code=400, detail="mode chỉ nhận 'full' hoặc 'decision'")
 
     # Đọc dữ liệu bytes từ file upload
     try:
-        image_bytes = await file.read()
-    except Exception as e:
+        with metrics.STAGE_SECONDS.time(stage="upload_read"):
+            image_bytes = await file.read()
+    except Exception:
         raise HTTPException(status_code=400, detail="Lỗi đọc file")
     print(f"🕵️‍♂️ Request từ: {user_name} (Source: {source})")
 
@@ -147,14 +310,25 @@ async def filter_image(
         "user": user_name
     }
 
-    # Gọi Tool Filter
-    is_valid, labels, details, action_result = filter_tool.process(image_bytes, metadata=metadata)
+    # Gọi Tool Filter trong thread pool riêng, hàng đợi đầy thì trả 503 để client thử lại sau
+    try:
+        is_valid, labels, details, action_result = await filter_executor.run(filter_tool.process, image_bytes, metadata=metadata, mode=mode)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server đang quá tải, vui lòng thử lại sau", headers={"Retry-After": "1"})
 
     # Trả kết quả JSON
-    conf_list = [d.get('confidence', 0) for d in details] if details else []
+    if mode == "decision":
+        return {"filename": file.filename, "is_valid": is_valid, "action": action_result, "detected_labels": labels}
+    return build_filter_response(file.filename, user_name, (is_valid, labels, details, action_result))
+
+def build_filter_response(filename, user_name, result):
+    """Định dạng kết quả lọc của 1 ảnh (dùng chung cho /v1/filter và /v1/filter/batch)"""
+    is_valid, labels, details, action_result = result
+    # details là chuỗi thông báo lỗi khi decode thất bại
+    conf_list = [d.get('confidence', 0) for d in details] if isinstance(details, list) else []
     # action_result = "KEEP" if is_valid else "UNPROCESSED"
     return {
-        "filename": file.filename,
+        "filename": filename,
         "is_valid": is_valid,
         "action": action_result,
         "detected_labels": labels, # List tên các vật thể
@@ -164,6 +338,129 @@ async def filter_image(
         "user": user_name
     }
 
+def _iter_request_images(files):
+    for file in files:
+        if is_archive(file.filename):
+            for name, data in iter_archive_images(file.file, file.filename, max_member_bytes=ARCHIVE_MAX_IMAGE_BYTES):
+                yield name, mimetypes.guess_type(name)[0] or "image/jpeg", data
+        else:
+            file.file.seek(0)
+            yield file.filename, file.content_type, file.file.read()
+
+def iter_batch_items(files, max_files=None):
+    """
+    Duyệt lần lượt các ảnh trong request, yield (filename, content_type, bytes).
+    File zip/tar được bung ra thành từng ảnh bên trong. Mỗi lần chỉ đọc 1 ảnh vào RAM.
+    Vượt quá max_files ảnh -> HTTPException 413.
+    """
+    for count, item in enumerate(_iter_request_images(files), start=1):
+        if max_files and count > max_files:
+            raise HTTPException(status_code=413, detail=f"Tối đa {max_files} ảnh mỗi request")
+        yield item
+
+def collect_batch_items(files):
+    """Đọc toàn bộ ảnh trong request thành list, giới hạn BATCH_MAX_FILES ảnh"""
+    return list(iter_batch_items(files, max_files=BATCH_MAX_FILES))
+
+def process_batch_items(items, source, user_name):
+    """Đưa list (filename, content_type, bytes) qua model theo batch, trả về list kết quả đã định dạng"""
+    metadatas = [{
+        "filename": filename,
+        "content_type": content_type,
+        "api_source": source,
+        "user": user_name
+    } for filename, content_type, _ in items]
+    results = filter_tool.process_batch([data for _, _, data in items], metadatas=metadatas)
+    return [build_filter_response(filename, user_name, result) for (filename, _, _), result in zip(items, results)]
+
+def run_batch(files, source, user_name):
+    """Chạy trong thread pool: đọc file rồi đưa toàn bộ ảnh qua model theo batch"""
+    return process_batch_items(collect_batch_items(files), source, user_name)
+
+def run_batch_chunk(item_iter, source, user_name):
+    """Chạy trong thread pool: lấy tối đa max_batch_size ảnh tiếp theo rồi xử lý. Hết ảnh -> []"""
+    chunk = list(itertools.islice(item_iter, filter_tool.max_batch_size))
+    return process_batch_items(chunk, source, user_name) if chunk else []
+
+@app.post("/v1/filter/batch")
+async def filter_batch(
+    files: List[UploadFile] = File(...),
+    source: Optional[str] = Form("unknown"),
+    user_name: str = Depends(get_api_key)
+):
+    """
+    Endpoint nhận nhiều ảnh trong 1 request và chạy model theo batch.
+
+    - **files**: Nhiều file ảnh, hoặc file nén .zip / .tar / .tar.gz chứa ảnh
+    - **source**: Nguồn gốc ảnh (tùy chọn)
+
+    Kết quả của từng ảnh có cùng định dạng với `/v1/filter`.
+    """
+    if not filter_tool:
+        raise HTTPException(status_code=503, detail="AI Service chưa sẵn sàng")
+    print(f"🕵️‍♂️ Batch request từ: {user_name} (Source: {source}, {len(files)} file)")
+
+    try:
+        results = await filter_executor.run(run_batch, files, source, user_name)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server đang quá tải, vui lòng thử lại sau", headers={"Retry-After": "1"})
+    except (zipfile.BadZipFile, tarfile.TarError):
+        raise HTTPException(status_code=400, detail="File nén bị lỗi hoặc không đúng định dạng")
+
+    return {
+        "count": len(results),
+        "results": results,
+        "user": user_name
+    }
+
+async def stream_batch_results(first_results, item_iter, source, user_name):
+    """Sinh từng dòng NDJSON, mỗi chunk ảnh được xử lý xong là gửi ngay cho client"""
+    results = first_results
+    while results:
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+        results = None
+        while results is None:
+            try:
+                results = await filter_executor.run(run_batch_chunk, item_iter, source, user_name)
+            except QueueFullError:
+                # Stream đã bắt đầu, không trả 503 được nữa -> chờ hàng đợi trống
+                await asyncio.sleep(0.05)
+            except (zipfile.BadZipFile, tarfile.TarError):
+                yield json.dumps({"error": "File nén bị lỗi hoặc không đúng định dạng"}, ensure_ascii=False) + "\n"
+                return
+            except HTTPException as e:
+                # Vượt giới hạn số ảnh giữa chừng: báo lỗi ở dòng cuối rồi dừng
+                yield json.dumps({"error": e.detail}, ensure_ascii=False) + "\n"
+                return
+
+@app.post("/v1/filter/batch/stream")
+async def filter_batch_stream(
+    files: List[UploadFile] = File(...),
+    source: Optional[str] = Form("unknown"),
+    user_name: str = Depends(get_api_key)
+):
+    """
+    Giống `/v1/filter/batch` nhưng trả kết quả dạng stream `application/x-ndjson`:
+    mỗi dòng là kết quả JSON của 1 ảnh, gửi ngay khi ảnh đó được xử lý xong.
+    Tối đa BATCH_STREAM_MAX_FILES ảnh, RAM server không tăng theo kích thước batch.
+    """
+    if not filter_tool:
+        raise HTTPException(status_code=503, detail="AI Service chưa sẵn sàng")
+    print(f"🕵️‍♂️ Batch stream request từ: {user_name} (Source: {source}, {len(files)} file)")
+
+    item_iter = iter_batch_items(files, max_files=BATCH_STREAM_MAX_FILES)
+    # Chạy chunk đầu trước khi mở stream để vẫn trả được 503/400 đúng nghĩa
+    try:
+        first_results = await filter_executor.run(run_batch_chunk, item_iter, source, user_name)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server đang quá tải, vui lòng thử lại sau", headers={"Retry-After": "1"})
+    except (zipfile.BadZipFile, tarfile.TarError):
+        raise HTTPException(status_code=400, detail="File nén bị lỗi hoặc không đúng định dạng")
+
+    return StreamingResponse(stream_batch_results(first_results, item_iter, source, user_name), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     # Chạy server ở port 8000
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
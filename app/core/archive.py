@@ -0,0 +1,54 @@
+import os
+import zipfile
+import tarfile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def is_image_name(filename):
+    return bool(filename) and filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_archive(filename):
+    return bool(filename) and filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _too_large(name, size, max_member_bytes):
+    if max_member_bytes and size > max_member_bytes:
+        print(f"[WARNING] Bỏ qua {name} trong file nén: {size} bytes vượt giới hạn {max_member_bytes} bytes")
+        return True
+    return False
+
+
+def iter_archive_images(fileobj, filename, max_member_bytes=None):
+    """
+    Duyệt lần lượt các ảnh trong file zip/tar mà không giải nén ra đĩa.
+    Mỗi lần yield (tên file, bytes), chỉ đọc 1 ảnh vào RAM tại 1 thời điểm.
+    Tên file chỉ giữ phần basename để tránh đường dẫn lạ (../) trong archive.
+    max_member_bytes: bỏ qua ảnh có kích thước sau giải nén lớn hơn giới hạn (chống zip bomb), None = không giới hạn.
+    """
+    if filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                # Bỏ thư mục và file rác của macOS
+                if info.is_dir() or info.filename.startswith("__MACOSX/") or not is_image_name(name):
+                    continue
+                # zipfile chỉ giải nén tối đa file_size khai báo trong header nên kiểm tra trước là đủ
+                if _too_large(name, info.file_size, max_member_bytes):
+                    continue
+                yield name, zf.read(info)
+    else:
+        # mode "r:*" tự nhận dạng nén gzip/bz2/xz
+        with tarfile.open(fileobj=fileobj, mode="r:*") as tf:
+            for member in tf:
+                name = os.path.basename(member.name)
+                if not member.isfile() or not is_image_name(name):
+                    continue
+                if _too_large(name, member.size, max_member_bytes):
+                    continue
+                extracted = tf.extractfile(member)
+                if extracted is None:
+                    continue
+                yield name, extracted.read()
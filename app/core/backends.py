@@ -0,0 +1,372 @@
+import os
+import ast
+import time
+import threading
+import cv2 #type: ignore
+import numpy as np #type: ignore
+
+# Mỗi backend trả về cho từng ảnh 1 mảng numpy (N, 6): [x1, y1, x2, y2, confidence, class_id]
+# theo tọa độ của ảnh gốc, đã qua NMS.
+EMPTY_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+
+
+def cuda_available():
+    """Kiểm tra GPU: ưu tiên torch nếu đã cài, không có torch thì hỏi ONNX Runtime"""
+    if os.getenv("CUDA_VISIBLE_DEVICES") == "-1":
+        return False
+    try:
+        import torch #type: ignore
+        return torch.cuda.is_available()
+    except ImportError:
+        pass
+    try:
+        import onnxruntime as ort #type: ignore
+        return "CUDAExecutionProvider" in ort.get_available_providers()
+    except ImportError:
+        return False
+
+
+def resolve_device(device):
+    """
+    Chọn thiết bị chạy model: "auto" -> GPU 0 nếu có, không thì "cpu".
+    Chọn GPU (0, "cuda", "cuda:1"...) mà máy không có CUDA -> tự lùi về "cpu".
+    """
+    if device is None or str(device).lower() == "auto":
+        return 0 if cuda_available() else "cpu"
+    if str(device).lower() == "cpu":
+        return "cpu"
+    if not cuda_available():
+        print(f"[WARNING] Đã chọn GPU ({device}) nhưng không tìm thấy CUDA -> Chuyển sang CPU")
+        return "cpu"
+    return device
+
+
+def cpu_thread_count():
+    """Số core thực sự được cấp cho process (tính cả giới hạn CPU affinity của container)"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def quantize_int8(model_path):
+    """Lượng tử hóa động sang INT8, lưu cạnh file gốc (*.int8.onnx) và dùng lại ở các lần sau"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType #type: ignore
+    int8_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+    if not os.path.exists(int8_path) or os.path.getmtime(int8_path) < os.path.getmtime(model_path):
+        print(f"[INFO] Đang lượng tử hóa INT8: {model_path} -> {int8_path}")
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+def warmup_backend(model, batch_sizes=(1,)):
+    """Chạy model trên ảnh đen với các batch size sẽ dùng để khởi tạo graph / kernel. Trả về số giây."""
+    size = getattr(model, "input_size", 640)
+    dummy = np.zeros((size, size, 3), dtype=np.uint8)
+    started = time.perf_counter()
+    for batch_size in batch_sizes:
+        model.predict([dummy] * batch_size)
+    return time.perf_counter() - started
+
+
+def nms(boxes, scores, iou_threshold):
+    """Non-maximum suppression trên numpy. Trả về index các box được giữ, theo thứ tự score giảm dần."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        # IoU giữa box đang xét và toàn bộ box còn lại, tính 1 lần cho cả mảng
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(detections, iou_threshold, max_det=300):
+    """NMS theo từng class trên mảng (N, 6): dịch box theo class_id để các class không đè nhau"""
+    if len(detections) == 0:
+        return detections
+    # Khoảng dịch phải lớn hơn tọa độ lớn nhất (ảnh gốc / ghép tile có thể > 7680 px)
+    offsets = detections[:, 5:6] * max(7680.0, float(detections[:, :4].max()) + 1.0)
+    keep = nms(detections[:, :4] + offsets, detections[:, 4], iou_threshold)[:max_det]
+    return detections[keep]
+
+
+def _static_batch_size(model_path):
+    """
+    Batch cố định của file model đã export (None = batch động, VD: .pt).
+    File export mặc định của Ultralytics (.onnx / .engine / .xml...) có batch cố định = 1.
+    """
+    ext = os.path.splitext(str(model_path))[1].lower()
+    if ext in ("", ".pt", ".yaml", ".yml"):
+        return None
+    if ext == ".onnx":
+        try:
+            import onnx #type: ignore
+            dim = onnx.load(str(model_path), load_external_data=False).graph.input[0].type.tensor_type.shape.dim[0]
+            # dim_param (VD: "batch") = export với dynamic=True
+            return int(dim.dim_value) if dim.HasField("dim_value") and dim.dim_value > 0 else None
+        except Exception:
+            return 1
+    return 1
+
+
+class UltralyticsBackend:
+    """
+    Backend mặc định: chạy qua wrapper YOLO của Ultralytics (.pt / .onnx / .engine...)
+    - static_batch: batch cố định của model export (mặc định tự đọc từ file); ảnh được chia thành
+      từng phần đúng kích thước đó (phần thiếu được lấp bằng ảnh cuối rồi bỏ kết quả thừa)
+    """
+    def __init__(self, model_path, device=None, static_batch=None, **kwargs):
+        from ultralytics import YOLO #type: ignore
+        self.model = YOLO(model_path, task="detect")
+        self.names = getattr(self.model, "names", None)
+        self.device = device
+        self.static_batch = static_batch if static_batch is not None else _static_batch_size(model_path)
+        if self.static_batch:
+            print(f"[INFO] Model export với batch cố định = {self.static_batch}, ảnh được chạy theo từng phần")
+
+    def predict(self, images, conf=0.1, iou=None, classes=None, max_det=300):
+        images = list(images)
+        if not self.static_batch:
+            return self._predict(images, conf, iou, classes, max_det)
+        outputs = []
+        for start in range(0, len(images), self.static_batch):
+            chunk = images[start:start + self.static_batch]
+            padded = chunk + [chunk[-1]] * (self.static_batch - len(chunk))
+            outputs.extend(self._predict(padded, conf, iou, classes, max_det)[:len(chunk)])
+        return outputs
+
+    def _predict(self, images, conf, iou, classes, max_det):
+        # iou không truyền thì để Ultralytics dùng ngưỡng NMS mặc định của nó (0.7)
+        options = {"iou": iou} if iou is not None else {}
+        results = self.model(images, conf=conf, classes=classes, max_det=max_det, device=self.device, verbose=False, **options)
+        # Chuyển cả tensor boxes sang numpy 1 lần cho mỗi ảnh
+        return [result.boxes.data.cpu().numpy() for result in results]
+
+
+class _InputBufferPool:
+    """
+    Giữ lại các cặp buffer (canvas uint8 NHWC, tensor float32 NCHW) để dùng lại giữa các lần predict,
+    tránh cấp phát ~6MB / ảnh 640x640 mỗi request. Buffer có sức chứa n ảnh dùng được cho mọi batch <= n.
+    """
+    def __init__(self, size, max_free=4):
+        self.size = size
+        self.max_free = max_free
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, n):
+        with self._lock:
+            # Lấy buffer nhỏ nhất còn đủ chỗ
+            # So theo vị trí: tuple chứa ndarray không so sánh bằng == được (list.remove sẽ lỗi)
+            fits = [i for i, b in enumerate(self._free) if len(b[0]) >= n]
+            if fits:
+                return self._free.pop(min(fits, key=lambda i: len(self._free[i][0])))
+        size = self.size
+        return np.empty((n, size, size, 3), dtype=np.uint8), np.empty((n, 3, size, size), dtype=np.float32)
+
+    def release(self, buf):
+        with self._lock:
+            self._free.append(buf)
+            if len(self._free) > self.max_free:
+                # Bỏ buffer nhỏ nhất, giữ lại các buffer dùng được cho batch lớn
+                self._free.pop(min(range(len(self._free)), key=lambda i: len(self._free[i][0])))
+
+
+class _LetterboxBackend:
+    """
+    Phần dùng chung cho các backend chạy trực tiếp file ONNX của YOLO:
+    letterbox + chuẩn hóa bằng numpy và hậu xử lý (decode output + NMS).
+    Lớp con chỉ cần cài đặt _run(batch) -> output numpy.
+    """
+    input_size = 640
+    dynamic_batch = True
+    names = None
+    _buffers = None
+
+    def predict(self, images, conf=0.1, iou=0.45, classes=None, max_det=300):
+        images = list(images)
+        if not images:
+            return []
+        if self.dynamic_batch:
+            outputs, metas = self._infer(images)
+        else:
+            # Model export với batch cố định = 1 -> chạy lần lượt từng ảnh
+            outputs, metas = [], []
+            for img in images:
+                output, meta = self._infer([img])
+                outputs.append(output)
+                metas.extend(meta)
+            outputs = np.concatenate(outputs, axis=0)
+        return [self._postprocess(out, meta, conf, iou, classes, max_det) for out, meta in zip(outputs, metas)]
+
+    def _infer(self, images):
+        pool = self._buffers
+        if pool is None:
+            pool = self._buffers = _InputBufferPool(self.input_size)
+        buf = pool.acquire(len(images))
+        try:
+            batch, metas = self._preprocess(images, buf)
+            # Output của runtime là mảng mới, trả buffer về pool ngay sau khi chạy xong
+            return self._run(batch), metas
+        finally:
+            pool.release(buf)
+
+    def _preprocess(self, images, buf=None):
+        size = self.input_size
+        n = len(images)
+        canvas, tensor = buf if buf is not None else (np.empty((n, size, size, 3), dtype=np.uint8), np.empty((n, 3, size, size), dtype=np.float32))
+        batch = canvas[:n]
+        batch.fill(114)
+        metas = []
+        for i, img in enumerate(images):
+            h, w = img.shape[:2]
+            ratio = min(size / h, size / w)
+            new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+            left = int(round((size - new_w) / 2 - 0.1))
+            top = int(round((size - new_h) / 2 - 0.1))
+            # Resize thẳng vào vùng giữa của canvas, không tạo thêm ảnh trung gian
+            cv2.resize(img, (new_w, new_h), dst=batch[i, top:top + new_h, left:left + new_w], interpolation=cv2.INTER_LINEAR)
+            metas.append((ratio, left, top, h, w))
+        # BGR -> RGB, NHWC -> NCHW, [0, 255] -> [0, 1] cho cả batch trong 1 lần, ghi thẳng vào tensor có sẵn
+        tensor = tensor[:n]
+        np.multiply(batch[..., ::-1].transpose(0, 3, 1, 2), np.float32(1.0 / 255.0), out=tensor, casting="unsafe")
+        return tensor, metas
+
+    def _postprocess(self, output, meta, conf, iou, classes, max_det):
+        ratio, left, top, h, w = meta
+        if output.ndim == 2 and output.shape[-1] == 6:
+            # Model export kèm NMS (end2end): mỗi dòng đã là [x1, y1, x2, y2, conf, cls]
+            dets = output[output[:, 4] > conf]
+            if classes is not None:
+                dets = dets[np.isin(dets[:, 5].astype(np.int64), classes)]
+        else:
+            # Output YOLOv8: (4 + nc, anchors) -> (anchors, 4 + nc)
+            preds = output.T
+            scores = preds[:, 4:]
+            if classes is not None:
+                class_mask = np.zeros(scores.shape[1], dtype=bool)
+                class_mask[np.asarray(classes, dtype=np.int64)] = True
+                scores = np.where(class_mask, scores, 0.0)
+            cls_ids = scores.argmax(axis=1)
+            confs = scores[np.arange(len(scores)), cls_ids]
+            keep = confs > conf
+            if not keep.any():
+                return EMPTY_DETECTIONS
+            xywh = preds[keep, :4]
+            dets = np.empty((int(keep.sum()), 6), dtype=np.float32)
+            dets[:, 0] = xywh[:, 0] - xywh[:, 2] / 2
+            dets[:, 1] = xywh[:, 1] - xywh[:, 3] / 2
+            dets[:, 2] = xywh[:, 0] + xywh[:, 2] / 2
+            dets[:, 3] = xywh[:, 1] + xywh[:, 3] / 2
+            dets[:, 4] = confs[keep]
+            dets[:, 5] = cls_ids[keep]
+            dets = batched_nms(dets, iou, max_det)
+
+        if len(dets) == 0:
+            return EMPTY_DETECTIONS
+        # Bỏ padding + scale về tọa độ ảnh gốc
+        dets = dets.copy()
+        dets[:, [0, 2]] = ((dets[:, [0, 2]] - left) / ratio).clip(0, w)
+        dets[:, [1, 3]] = ((dets[:, [1, 3]] - top) / ratio).clip(0, h)
+        return dets[:max_det]
+
+    def _run(self, batch):
+        raise NotImplementedError
+
+
+class OnnxRuntimeBackend(_LetterboxBackend):
+    """
+    Chạy file .onnx trực tiếp bằng ONNX Runtime, bỏ qua wrapper của Ultralytics.
+
+    - device: "cpu" hoặc id GPU (0, "cuda:1"...)
+    - threads: số intra-op thread khi chạy CPU (mặc định = số core được cấp)
+    - int8: True để lượng tử hóa INT8 khi chạy CPU
+    """
+    def __init__(self, model_path, device="cpu", providers=None, session_options=None, threads=None, int8=False, **kwargs):
+        import onnxruntime as ort #type: ignore
+        on_cpu = str(device).lower() == "cpu"
+        if providers is None:
+            if on_cpu:
+                providers = ["CPUExecutionProvider"]
+            else:
+                device_id = int(str(device).split(":")[-1]) if str(device).split(":")[-1].isdigit() else 0
+                providers = [("CUDAExecutionProvider", {"device_id": device_id}), "CPUExecutionProvider"]
+
+        if session_options is None:
+            session_options = ort.SessionOptions()
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if on_cpu:
+                # 1 request = 1 lần chạy tuần tự, song song hóa bên trong từng op với đủ số core
+                session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                session_options.intra_op_num_threads = int(threads or cpu_thread_count())
+                session_options.inter_op_num_threads = 1
+
+        if int8 and on_cpu:
+            model_path = quantize_int8(model_path)
+
+        self.session = ort.InferenceSession(model_path, sess_options=session_options, providers=providers)
+        self.providers = self.session.get_providers()
+        self.threads = session_options.intra_op_num_threads
+        print(f"[INFO] ONNX Runtime: provider={self.providers[0]} | intra-op threads={self.threads or 'auto'} | int8={bool(int8 and on_cpu)}")
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        batch_dim, _, height, _ = model_input.shape
+        self.dynamic_batch = not isinstance(batch_dim, int)
+        self.input_size = height if isinstance(height, int) else 640
+
+        # Ultralytics lưu tên class trong metadata của file onnx dạng "{0: 'person', ...}"
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        self.names = ast.literal_eval(names) if names else None
+
+    def _run(self, batch):
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+
+class OpenVINOBackend(_LetterboxBackend):
+    """Chạy file .onnx / .xml bằng OpenVINO trên CPU Intel"""
+    def __init__(self, model_path, device_name="CPU", **kwargs):
+        import openvino as ov #type: ignore
+        core = ov.Core()
+        model = core.read_model(model_path)
+        batch_dim, _, height, _ = model.inputs[0].get_partial_shape()
+        self.dynamic_batch = batch_dim.is_dynamic
+        self.input_size = height.get_length() if height.is_static else 640
+        self.compiled = core.compile_model(model, device_name, {"PERFORMANCE_HINT": "THROUGHPUT"})
+        self.output = self.compiled.outputs[0]
+
+    def _run(self, batch):
+        return self.compiled(batch)[self.output]
+
+
+BACKENDS = {
+    "ultralytics": UltralyticsBackend,
+    "onnxruntime": OnnxRuntimeBackend,
+    "openvino": OpenVINOBackend,
+}
+
+
+def create_backend(backend, model_path, device="cpu", **options):
+    """
+    Tạo backend inference theo tên ("ultralytics" / "onnxruntime" / "openvino").
+    Nếu truyền vào 1 object đã có sẵn hàm predict thì dùng luôn object đó.
+    """
+    if not isinstance(backend, str):
+        return backend
+    name = backend.lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Backend không hỗ trợ: {backend}. Chọn 1 trong {list(BACKENDS)}")
+    if name != "ultralytics" and not os.path.splitext(str(model_path))[1] in (".onnx", ".xml"):
+        raise ValueError(f"Backend {name} cần file .onnx (hoặc .xml cho OpenVINO), nhận được: {model_path}")
+    print(f"[INFO] Dùng backend inference: {name}")
+    return BACKENDS[name](model_path, device=device, **options)
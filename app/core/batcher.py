@@ -0,0 +1,123 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class InferenceBatcher:
+    """
+    Gom ảnh đã decode từ nhiều request đồng thời thành 1 lần gọi model.
+
+    - predict_fn: hàm nhận list ảnh (+ tham số dạng keyword), trả về list kết quả (cùng thứ tự)
+    - max_batch_size: số ảnh tối đa trong 1 batch
+    - max_wait_ms: thời gian tối đa chờ gom batch, tính từ ảnh đầu tiên vào hàng đợi
+    - max_inflight: số batch được chạy đồng thời (>1 khi model chạy trên nhiều process / GPU)
+    """
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10, max_inflight=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms) / 1000.0)
+        self.stats = {"batches": 0, "images": 0, "max_batch_seen": 0}
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._inflight = threading.BoundedSemaphore(max(1, int(max_inflight)))
+        self._runner = ThreadPoolExecutor(max_workers=max(1, int(max_inflight)), thread_name_prefix="inference-batch") if max_inflight > 1 else None
+        self._worker = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._worker.start()
+        print(f"[INFO] Batching bật: tối đa {self.max_batch_size} ảnh / {max_wait_ms} ms")
+
+    def submit(self, image, **params):
+        """
+        Đưa 1 ảnh vào hàng đợi, trả về Future chứa kết quả riêng của ảnh đó.
+        params (giá trị phải hashable) được truyền cho predict_fn; ảnh khác params chạy ở lần gọi riêng.
+        """
+        if self._closed:
+            raise RuntimeError("InferenceBatcher đã đóng")
+        future = Future()
+        self._queue.put((image, future, tuple(sorted(params.items()))))
+        return future
+
+    def predict(self, image, **params):
+        """Gọi đồng bộ: chờ tới khi batch chứa ảnh này chạy xong"""
+        return self.submit(image, **params).result()
+
+    @property
+    def depth(self):
+        """Số ảnh đang chờ gom batch"""
+        return self._queue.qsize()
+
+    def _collect(self):
+        """Lấy 1 batch: chặn tới khi có ảnh đầu tiên, sau đó gom thêm tới khi đủ size hoặc hết giờ"""
+        item = self._queue.get()
+        if item is None:
+            return None, True
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Hết giờ chờ nhưng hàng đợi vẫn còn ảnh thì lấy luôn, không chờ thêm
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+
+            # Bỏ qua các request đã bị hủy trước khi chạy model
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            # Chờ tới khi có chỗ trống (giới hạn max_inflight batch chạy cùng lúc) rồi mới gom batch tiếp
+            self._inflight.acquire()
+            if self._runner:
+                self._runner.submit(self._run_batch, batch)
+            else:
+                self._run_batch(batch)
+
+        if self._runner:
+            self._runner.shutdown(wait=True)
+
+    def _run_batch(self, batch):
+        try:
+            # Tách theo params (thường chỉ có 1 nhóm)
+            groups = {}
+            for img, fut, params in batch:
+                groups.setdefault(params, []).append((img, fut))
+            for params, items in groups.items():
+                images = [img for img, _ in items]
+                try:
+                    outputs = self.predict_fn(images, **dict(params))
+                except Exception as e:
+                    print(f"[ERROR] ❌ Lỗi khi chạy batch {len(images)} ảnh: {e}")
+                    for _, fut in items:
+                        fut.set_exception(e)
+                    continue
+
+                for (_, fut), output in zip(items, outputs):
+                    fut.set_result(output)
+
+            self.stats["batches"] += 1
+            self.stats["images"] += len(batch)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+        finally:
+            self._inflight.release()
+
+    def close(self, timeout=5):
+        """Dừng worker sau khi chạy hết các ảnh còn trong hàng đợi"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout=timeout)
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app.core.metrics import RESULT_CACHE_TOTAL
+
+
+def make_cache_key(image_bytes, model_id, targets, extra=""):
+    """Key = hash(bytes ảnh) + định danh model + danh sách target (đã sắp xếp) + tham số phụ"""
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    suffix = "|".join([str(model_id), ",".join(sorted(targets)), str(extra)])
+    return f"{image_hash}:{hashlib.sha1(suffix.encode('utf-8')).hexdigest()[:16]}"
+
+
+class MongoCacheTier:
+    """
+    Tầng cache chia sẻ giữa nhiều instance qua 1 collection MongoDB.
+    Document tự hết hạn nhờ TTL index; việc ghi chạy nền để không chặn request.
+    """
+    def __init__(self, collection, ttl=3600):
+        self.collection = collection
+        self.collection.create_index("created_at", expireAfterSeconds=int(ttl))
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+
+    def get(self, key):
+        try:
+            doc = self.collection.find_one({"_id": key}, {"value": 1})
+            return doc["value"] if doc else None
+        except Exception as e:
+            print(f"[WARNING] Lỗi đọc cache MongoDB: {e}")
+            return None
+
+    def set(self, key, value):
+        self._writer.submit(self._write, key, value)
+
+    def _write(self, key, value):
+        try:
+            self.collection.replace_one({"_id": key}, {"_id": key, "value": value, "created_at": datetime.utcnow()}, upsert=True)
+        except Exception as e:
+            print(f"[WARNING] Lỗi ghi cache MongoDB: {e}")
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+
+
+class ResultCache:
+    """
+    Cache kết quả detection theo nội dung ảnh để ảnh trùng không phải decode + inference lại.
+
+    - max_items: số entry tối đa trong RAM (LRU, entry ít dùng nhất bị đẩy ra)
+    - ttl: số giây 1 entry còn hiệu lực
+    - shared_tier: tầng chia sẻ tùy chọn (VD: MongoCacheTier), hỏi khi RAM miss
+    """
+    def __init__(self, max_items=10000, ttl=3600, shared_tier=None):
+        self.max_items = max(1, int(max_items))
+        self.ttl = float(ttl)
+        self.shared_tier = shared_tier
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        self._items = OrderedDict() # key -> (thời điểm hết hạn, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._items.move_to_end(key)
+                    self.stats["hits"] += 1
+                    RESULT_CACHE_TOTAL.inc(event="hit")
+                    return value
+                del self._items[key]
+                self.stats["expired"] += 1
+                RESULT_CACHE_TOTAL.inc(event="expired")
+
+        if self.shared_tier is not None:
+            value = self.shared_tier.get(key)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.stats["shared_hits"] += 1
+                RESULT_CACHE_TOTAL.inc(event="shared_hit")
+                return value
+
+        with self._lock:
+            self.stats["misses"] += 1
+        RESULT_CACHE_TOTAL.inc(event="miss")
+        return None
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.shared_tier is not None:
+            self.shared_tier.set(key, value)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.stats["evictions"] += 1
+                RESULT_CACHE_TOTAL.inc(event="eviction")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["size"] = len(self._items)
+        stats["hit_rate"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self.shared_tier is not None:
+            self.shared_tier.close()
@@ -0,0 +1,112 @@
+import threading
+import time
+import cv2 #type: ignore
+import numpy as np #type: ignore
+
+# Hành động được phép ghi cho ảnh bị cascade loại
+REJECT_ACTIONS = ("SKIP", "UNPROCESSED")
+
+
+class _OnnxClassifier:
+    """Classifier nhỏ dạng ONNX (VD: YOLO-cls nano / MobileNet) trả xác suất ảnh có liên quan"""
+    def __init__(self, model_path, positive_index=1, input_size=224, threads=1):
+        import onnxruntime as ort #type: ignore
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.positive_index = positive_index
+        self.input_size = input_size
+
+    def score(self, img):
+        size = self.input_size
+        x = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)[..., ::-1].transpose(2, 0, 1)
+        x = np.ascontiguousarray(x[None], dtype=np.float32) / 255.0
+        out = np.asarray(self.session.run(None, {self.input_name: x})[0], dtype=np.float64).reshape(-1)
+        if out.size == 1:
+            # 1 output: logit hoặc xác suất của lớp "liên quan"
+            return float(out[0]) if 0.0 <= out[0] <= 1.0 else float(1.0 / (1.0 + np.exp(-out[0])))
+        if out.min() < 0 or abs(out.sum() - 1.0) > 1e-3:
+            out = np.exp(out - out.max())
+            out /= out.sum()
+        return float(out[self.positive_index])
+
+
+class CascadeGate:
+    """
+    Bộ lọc trước detector: loại nhanh các ảnh rõ ràng không liên quan, chỉ ảnh còn lại mới chạy YOLO đủ 126 class.
+
+    Tầng 1 (heuristic, < 1ms, tắt mặc định): ảnh gần như 1 màu (blank) và ảnh tài liệu / chụp màn hình chữ
+    (gần như toàn nền sáng, ít màu). Ảnh sản phẩm chụp nền trắng (giấy, áo thun...) cũng khớp điều kiện này,
+    nên chỉ bật khi nguồn ảnh không có loại đó. Tầng 2 (tùy chọn): classifier ONNX nhỏ, loại ảnh có điểm < reject_below.
+
+    - heuristics: bật tầng heuristic
+    - blank_std: độ lệch chuẩn độ sáng tối đa để coi là ảnh trống
+    - document_white_ratio / document_max_saturation: tỉ lệ pixel nền sáng tối thiểu và độ bão hòa màu trung bình tối đa
+    - classifier_path: file .onnx của classifier (None = chỉ dùng heuristic)
+    - reject_below: ngưỡng điểm classifier để loại ảnh
+    - reject_action: hành động ghi cho ảnh bị loại ("SKIP" hoặc "UNPROCESSED")
+    """
+    def __init__(self, heuristics=False, blank_std=6.0, document_white_ratio=0.85, document_max_saturation=20.0, classifier_path=None, positive_index=1, classifier_input_size=224, reject_below=0.05, reject_action="SKIP"):
+        reject_action = str(reject_action).upper()
+        if reject_action not in REJECT_ACTIONS:
+            raise ValueError(f"reject_action không hợp lệ: {reject_action}. Chọn 1 trong {list(REJECT_ACTIONS)}")
+        self.heuristics = heuristics
+        self.blank_std = blank_std
+        self.document_white_ratio = document_white_ratio
+        self.document_max_saturation = document_max_saturation
+        self.reject_below = reject_below
+        self.reject_action = reject_action
+        self.classifier = _OnnxClassifier(classifier_path, positive_index, classifier_input_size) if classifier_path else None
+        self.stats = {"checked": 0, "passed": 0, "rejected_heuristic": 0, "rejected_classifier": 0, "classified": 0, "heuristic_ms": 0.0, "classifier_ms": 0.0}
+        self._lock = threading.Lock()
+
+    def check(self, img):
+        """
+        Trả về dict thông tin cascade để ghi log: {"rejected": bool, "stage", "reason", "score", "latency_ms": {...}}
+        """
+        reason = None
+        latency = {}
+        result = {"rejected": False, "stage": None, "reason": None, "score": None, "latency_ms": latency}
+        if self.heuristics:
+            started = time.perf_counter()
+            thumb = cv2.resize(img, (64, 64), interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+            if gray.std() < self.blank_std:
+                reason = "Blank Image"
+            else:
+                saturation = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)[..., 1].mean()
+                if saturation < self.document_max_saturation and (gray > 200).mean() > self.document_white_ratio:
+                    reason = "Document / Text Screenshot"
+            latency["heuristic"] = round((time.perf_counter() - started) * 1000, 2)
+            result.update(rejected=reason is not None, stage="heuristic", reason=reason)
+
+        if reason is None and self.classifier:
+            started = time.perf_counter()
+            score = self.classifier.score(img)
+            latency["classifier"] = round((time.perf_counter() - started) * 1000, 2)
+            result.update(stage="classifier", score=round(score, 4))
+            if score < self.reject_below:
+                result.update(rejected=True, reason=f"Classifier Score < {self.reject_below}")
+
+        with self._lock:
+            self.stats["checked"] += 1
+            self.stats["heuristic_ms"] += latency.get("heuristic", 0.0)
+            if "classifier" in latency:
+                self.stats["classified"] += 1
+                self.stats["classifier_ms"] += latency["classifier"]
+            if not result["rejected"]:
+                self.stats["passed"] += 1
+            else:
+                self.stats[f"rejected_{result['stage']}"] += 1
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        checked = stats["checked"] or 1
+        stats["reject_rate"] = round((stats["rejected_heuristic"] + stats["rejected_classifier"]) / checked, 4)
+        # Latency trung bình mỗi ảnh của từng tầng
+        stats["heuristic_ms"] = round(stats["heuristic_ms"] / checked, 3)
+        stats["classifier_ms"] = round(stats["classifier_ms"] / (stats["classified"] or 1), 3)
+        return stats
@@ -0,0 +1,57 @@
+import struct
+import cv2 #type: ignore
+import numpy as np #type: ignore
+
+# Các marker SOF của JPEG (baseline, progressive...) chứa kích thước ảnh; bỏ DHT (C4), JPG (C8), DAC (CC)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# libjpeg scale DCT khi decode: chỉ giải mã 1/2, 1/4, 1/8 số hệ số thay vì decode đủ rồi resize
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def jpeg_size(data):
+    """Đọc (h, w) từ header JPEG mà không decode. Không phải JPEG hoặc header hỏng -> None"""
+    n = len(data)
+    if n < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # Byte đệm giữa các marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8: # Marker không có phần độ dài
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            h, w = struct.unpack(">HH", bytes(data[i + 5:i + 9]))
+            return (h, w) if h and w else None
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def decode_image(data, target_size=None):
+    """
+    Decode bytes ảnh sang BGR. Nếu là JPEG lớn hơn target_size nhiều lần thì decode thẳng
+    ở 1/2, 1/4 hoặc 1/8 độ phân giải, chọn mức nhỏ nhất mà cạnh dài vẫn >= target_size.
+    Trả về (ảnh, (h, w) của ảnh gốc), decode lỗi -> (None, None).
+    """
+    buf = np.frombuffer(data, np.uint8)
+    size = jpeg_size(data) if target_size else None
+    if size:
+        for factor, flag in _REDUCED_FLAGS:
+            if max(size) / factor >= target_size:
+                img = cv2.imdecode(buf, flag)
+                if img is None:
+                    return None, None
+                h, w = size
+                # Ảnh có EXIF xoay 90/270 độ -> ảnh decode ra bị đổi chiều so với header
+                if abs(img.shape[0] - -(-h // factor)) > 1:
+                    h, w = w, h
+                return img, (h, w)
+
+    img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if img is None:
+        return None, None
+    return img, img.shape[:2]
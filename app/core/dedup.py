@@ -0,0 +1,147 @@
+import itertools
+import threading
+from collections import OrderedDict
+import cv2 #type: ignore
+import numpy as np #type: ignore
+
+
+def dhash(img, hash_size=8):
+    """Difference hash: so sánh độ sáng các pixel liền kề trên ảnh xám thu nhỏ. Trả về int 64 bit."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def phash(img, hash_size=8, highfreq_factor=4):
+    """Perceptual hash: lấy các hệ số DCT tần số thấp so với median. Bền với resize và nén lại JPEG."""
+    size = hash_size * highfreq_factor
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    # Bỏ hệ số DC (độ sáng trung bình) khi tính median
+    median = np.median(low_freq.flatten()[1:])
+    bits = low_freq > median
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def rescale_detections(detections, src_shape, dst_shape):
+    """Đổi tọa độ box từ kích thước ảnh gốc (h, w) sang kích thước ảnh trùng (h, w)"""
+    if tuple(src_shape) == tuple(dst_shape):
+        return detections
+    scale_y = dst_shape[0] / src_shape[0]
+    scale_x = dst_shape[1] / src_shape[1]
+    rescaled = []
+    for d in detections:
+        x1, y1, x2, y2 = d["box"]
+        rescaled.append(dict(d, box=[round(x1 * scale_x, 1), round(y1 * scale_y, 1), round(x2 * scale_x, 1), round(y2 * scale_y, 1)]))
+    return rescaled
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing theo khoảng cách Hamming: chia hash thành num_bands dải bit, mỗi dải 1 bảng băm tra chính xác.
+    Theo nguyên lý Dirichlet, 2 hash cách nhau <= max_distance thì có ít nhất 1 dải cách nhau <= max_distance // num_bands,
+    nên chỉ cần tra vài bucket lân cận của từng dải thay vì duyệt cây. Xóa được phần tử bất kỳ (không phải dựng lại).
+    """
+    def __init__(self, max_distance, bits=64, num_bands=4):
+        self.max_distance = int(max_distance)
+        self.num_bands = max(1, min(int(num_bands), bits))
+        widths = [bits // self.num_bands + (1 if i < bits % self.num_bands else 0) for i in range(self.num_bands)]
+        shifts = [sum(widths[i + 1:]) for i in range(self.num_bands)]
+        self._bands = [(shift, (1 << width) - 1) for shift, width in zip(shifts, widths)]
+        # Các mặt nạ XOR lật <= max_distance // num_bands bit trong 1 dải -> các bucket lân cận cần tra
+        radius = self.max_distance // self.num_bands
+        self._probes = [
+            [0] + [sum(1 << b for b in flipped) for r in range(1, radius + 1) for flipped in itertools.combinations(range(width), r)]
+            for width in widths
+        ]
+        self._tables = [{} for _ in range(self.num_bands)]
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, h, value):
+        if h not in self.values: # Trùng hash tuyệt đối -> chỉ ghi đè giá trị mới nhất
+            for table, (shift, mask) in zip(self._tables, self._bands):
+                table.setdefault((h >> shift) & mask, set()).add(h)
+        self.values[h] = value
+
+    def remove(self, h):
+        if self.values.pop(h, None) is None:
+            return
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            key = (h >> shift) & mask
+            bucket = table[key]
+            bucket.discard(h)
+            if not bucket:
+                del table[key]
+
+    def search(self, h):
+        """Trả về (distance, hash, value) gần nhất có distance <= max_distance, hoặc None"""
+        if h in self.values:
+            return 0, h, self.values[h]
+        best = None
+        seen = set()
+        for table, (shift, mask), probes in zip(self._tables, self._bands, self._probes):
+            key = (h >> shift) & mask
+            for probe in probes:
+                for candidate in table.get(key ^ probe, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    dist = hamming(h, candidate)
+                    if dist <= self.max_distance and (best is None or dist < best[0]):
+                        best = (dist, candidate)
+        return (best[0], best[1], self.values[best[1]]) if best else None
+
+
+class NearDuplicateIndex:
+    """
+    Chỉ mục ảnh đã xử lý theo perceptual hash để nhận ra bản sao đã bị resize / nén lại.
+
+    - threshold: khoảng cách Hamming tối đa (trên 64 bit) để coi là trùng
+    - max_items: số ảnh tối đa trong chỉ mục, vượt quá thì bỏ ảnh cũ nhất
+    - method: "phash" hoặc "dhash"
+    - num_bands: số dải bit của multi-index hashing (nhiều dải -> bucket nhỏ hơn nhưng tra nhiều bucket lân cận hơn)
+    """
+    def __init__(self, threshold=6, max_items=50000, method="phash", num_bands=4):
+        self.threshold = int(threshold)
+        self.max_items = max(2, int(max_items))
+        self.hash_fn = dhash if method == "dhash" else phash
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+        self._index = MultiIndexHash(self.threshold, bits=64, num_bands=num_bands)
+        self._order = OrderedDict() # Hash theo thứ tự thêm vào, dùng để bỏ ảnh cũ nhất
+        # Mỗi lần tra chỉ chạm vài bucket nên giữ lock rất ngắn
+        self._lock = threading.Lock()
+
+    def compute(self, img):
+        return self.hash_fn(img)
+
+    def lookup(self, h):
+        """Tìm ảnh gần giống nhất. Trả về (distance, entry) hoặc None"""
+        with self._lock:
+            found = self._index.search(h)
+            self.stats["hits" if found else "misses"] += 1
+        return (found[0], found[2]) if found else None
+
+    def add(self, h, entry):
+        with self._lock:
+            self._index.add(h, entry)
+            self._order[h] = None
+            self._order.move_to_end(h) # Ảnh trùng tuyệt đối được coi là mới nhất
+            while len(self._order) > self.max_items:
+                self._index.remove(self._order.popitem(last=False)[0])
+                self.stats["evictions"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._index)
+        return stats
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Hàng đợi xử lý đã đầy, request nên được từ chối (429/503)"""
+    pass
+
+
+class BoundedExecutor:
+    """
+    Thread pool riêng cho phần việc nặng (decode, inference, lưu trữ) để không chặn event loop.
+
+    - max_workers: số việc chạy song song tối đa
+    - max_pending: số việc được phép xếp hàng chờ thêm; vượt quá -> QueueFullError
+    """
+    def __init__(self, max_workers=8, max_pending=32, name="filter-worker"):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(0, int(max_pending))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._inflight = 0 # Số việc đang chạy + đang chờ
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Gửi việc vào pool, trả về concurrent Future. Ném QueueFullError nếu đã đầy."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(f"Đang có {self.depth} việc trong hàng đợi")
+
+        with self._lock:
+            self._inflight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Bản async của submit: await tới khi xong mà không chặn event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self):
+        with self._lock:
+            self._inflight -= 1
+        self._slots.release()
+
+    @property
+    def depth(self):
+        """Số việc đang chạy + đang chờ (queue depth)"""
+        return self._inflight
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -1,23 +1,104 @@
-import torch #type: ignore
 import os
-import mimetypes
-import cv2 #type: ignore
+import threading
+from contextlib import nullcontext
 import numpy as np #type: ignore
-from pymongo import MongoClient, errors  #type: ignore
-from bson.binary import Binary #type: ignore
-from ultralytics import YOLO #type: ignore
-from datetime import datetime
-import io
+from pymongo import MongoClient #type: ignore
 from minio import Minio #type: ignore
-from minio.error import S3Error #type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from app.core.batcher import InferenceBatcher
+from app.core.log_writer import MongoLogWriter, ensure_log_indexes
+from app.core.uploader import MinioUploader
+from app.core.cache import ResultCache, MongoCacheTier, make_cache_key
+from app.core.dedup import NearDuplicateIndex, rescale_detections
+from app.core.decode import decode_image
+from app.core.labels import LabelSpace
+from app.core.cascade import CascadeGate
+from app.core.tiling import SlicedInference
+from app.core.metrics import STAGE_SECONDS, IMAGES_TOTAL, TARGET_LABELS_TOTAL, INFERENCE_BATCH_SIZE
+from app.core.backends import create_backend, resolve_device, warmup_backend
+from app.core.workers import InferencePool
 class ImageFilter:
-    def __init__(self, model_path, mongo_uri, db_name, collection_name,target_classes, minio_config, image_handler = None, log_handler = None, enable_filter = True, device=0,class_mapping=None):
+    def __init__(self, model_path, mongo_uri, db_name, collection_name,target_classes, minio_config, image_handler = None, log_handler = None, enable_filter = True, device="auto",class_mapping=None, batch_config=None, log_writer_config=None, upload_config=None, cache_config=None, dedup_config=None, backend="ultralytics", backend_options=None, worker_config=None, warmup=True, reduced_decode=True, label_synonyms=None, decision_config=None, cascade_config=None, tiling_config=None):
         self.class_mapping = class_mapping  
         self.enable_filter = enable_filter
         self.device = device
-        self.target_classes = set(target_classes)
-        self.stats = {label: 0 for label in target_classes} # Thống kê
-        
+        self.reduced_decode = reduced_decode
+        # Chế độ decision-only: chỉ cần biết có target hay không (VD: {"conf": 0.25, "max_det": 10})
+        self.decision_config = dict({"conf": 0.25, "max_det": 10}, **(decision_config or {}))
+        self.batcher = None
+        self._model_lock = threading.Lock()
+        # Số ảnh tối đa mỗi lần gọi model: theo batch_config, 1 khi tắt batching
+        self.max_batch_size = max(1, int(batch_config.get("max_batch_size", 8))) if batch_config else 1
+        self.log_writer = None
+        self.uploader = None
+        self.result_cache = None
+        self.dedup_index = None
+        self.cascade = None
+        # Ảnh lớn chạy theo tile chồng lấn (VD: {"tile_size": 640, "min_side": 1600, "max_tiles": 8})
+        self.tiling = SlicedInference(**tiling_config) if tiling_config else None
+        self.model_id = f"{backend}:{self._model_identity(model_path)}" if isinstance(backend, str) else self._model_identity(model_path)
+        self.model = None
+
+        # Kết nối MinIO, MongoDB và load model chạy song song để khởi động nhanh hơn
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="filter-init") as pool:
+            tasks = [
+                pool.submit(self._init_storage, minio_config, image_handler, upload_config),
+                pool.submit(self._init_logging, mongo_uri, db_name, collection_name, log_handler, log_writer_config)
+            ]
+            if self.enable_filter:
+                tasks.append(pool.submit(self._init_model, model_path, device, backend, backend_options, worker_config, warmup))
+            else:
+                print("Filter đang tắt. Mọi ảnh sẽ được chấp nhận.")
+        try:
+            for task in tasks:
+                task.result()
+        except Exception:
+            # Dọn các worker nền đã kịp khởi động trước khi báo lỗi (để lần thử lại không bị rò rỉ)
+            self.close()
+            raise
+
+        # Nhãn chuẩn hóa (gộp tên đồng nghĩa / sai chính tả) + mask target theo class id dựng sẵn
+        self.labels = LabelSpace(self.class_mapping or getattr(self.model, "names", None) or {}, synonyms=label_synonyms)
+        self.target_classes = self.labels.normalize_targets(target_classes)
+        unknown = [t for t in self.target_classes if t not in self.labels.ids_by_name]
+        if unknown and self.labels.num_classes:
+            print(f"[WARNING] Target không có trong danh sách nhãn của model: {sorted(unknown)}")
+
+        # Cache kết quả theo nội dung ảnh (VD: {"max_items": 10000, "ttl": 3600, "shared_collection": "result_cache"})
+        if cache_config:
+            cache_config = dict(cache_config)
+            shared_collection = cache_config.pop("shared_collection", None)
+            shared_tier = None
+            if shared_collection and hasattr(self, "db"):
+                shared_tier = MongoCacheTier(self.db[shared_collection], ttl=cache_config.get("ttl", 3600))
+                print(f"[INFO] Cache kết quả dùng thêm tầng chia sẻ MongoDB: {shared_collection}")
+            self.result_cache = ResultCache(shared_tier=shared_tier, **cache_config)
+            print(f"[INFO] Cache kết quả bật: tối đa {self.result_cache.max_items} ảnh, TTL {self.result_cache.ttl:.0f}s")
+
+        # Chỉ mục ảnh gần trùng theo perceptual hash (VD: {"threshold": 6, "max_items": 50000})
+        if dedup_config:
+            self.dedup_index = NearDuplicateIndex(**dedup_config)
+            print(f"[INFO] Phát hiện ảnh gần trùng bật: ngưỡng Hamming {self.dedup_index.threshold}/64")
+
+        # Lọc trước bằng heuristic / classifier nhỏ, ảnh rõ ràng không liên quan không phải chạy detector
+        # (VD: {"classifier_path": "cls.onnx", "reject_below": 0.05, "reject_action": "SKIP"})
+        if self.enable_filter and cascade_config:
+            self.cascade = CascadeGate(**cascade_config)
+            stages = [name for name, on in (("heuristic", self.cascade.heuristics), ("classifier", self.cascade.classifier)) if on]
+            if stages:
+                print(f"[INFO] Cascade lọc trước bật ({' + '.join(stages)}), ảnh bị loại -> {self.cascade.reject_action}")
+            else:
+                print("[WARNING] Cascade bật nhưng không có tầng nào (heuristics tắt, không có classifier) -> không loại ảnh nào")
+
+        # Gom ảnh từ các request đồng thời thành batch (VD: {"max_batch_size": 8, "max_wait_ms": 10})
+        if self.enable_filter and batch_config:
+            batch_config = dict(batch_config)
+            if isinstance(self.model, InferencePool):
+                # Mỗi process inference nhận 1 batch riêng
+                batch_config.setdefault("max_inflight", self.model.num_workers)
+            self.batcher = InferenceBatcher(self.predict_batch, **batch_config)
+
+    def _init_storage(self, minio_config, image_handler, upload_config):
         if image_handler:
             self.image_handler = image_handler
             print("[INFOR] Đang sử dụng loại lưu trữ ảnh từ user")
@@ -42,12 +123,18 @@ class ImageFilter:
             except Exception as e:
                 print(f"[ERROR] ❌ Không thể kết nối MinIO: {e}")
                 self.minio_client = None
-            self.image_handler = self._upload_to_minio
+            if self.minio_client:
+                # Upload chạy nền bằng worker pool, request không phải chờ put_object
+                self.uploader = MinioUploader(self.minio_client, self.bucket_name, **(upload_config or {}))
+                self.image_handler = self.uploader
+            else:
+                self.image_handler = lambda data, name : None
             print("[INFOR] Đang sử dụng loại lưu trữ ảnh là MinIO")
         else:
             self.image_handler = lambda data, name : None
             print("[Warning] Không có cấu hình lưu ảnh")
-        
+
+    def _init_logging(self, mongo_uri, db_name, collection_name, log_handler, log_writer_config):
         if log_handler:
             self.log_handler = log_handler
             print("[INFOR] Đang dùng database do user tùy chỉnh")
@@ -57,131 +144,306 @@ class ImageFilter:
             self.collection = self.db[collection_name]
             self.mongo_client.server_info()
             print(f"[INFOR] Đã kết nối tới Mongo ở database: {db_name}")
-            self.log_handler = self._log_to_mongo
-            print("[INFO] Sử dụng Default MongoDB Handler.")
+            try:
+                ensure_log_indexes(self.collection)
+            except Exception as e:
+                # Thiếu chỉ mục chỉ làm truy vấn chậm, không chặn service khởi động
+                print(f"[WARNING] Không tạo được chỉ mục cho collection log: {e}")
+            # Ghi log nền theo batch để không tốn 1 round trip Mongo cho mỗi request
+            self.log_writer = MongoLogWriter(self.collection, **(log_writer_config or {}))
+            self.log_handler = self.log_writer
+            print("[INFO] Sử dụng Default MongoDB Handler (ghi nền theo batch).")
         else:
             self.log_handler = lambda **kwargs: print(f"[LOG] {kwargs.get('action')}")
             print("[WARNING] Không có cấu hình Database. Log chỉ in ra console.")
-            
-        if self.enable_filter:
-            # Check nhanh xem máy host có nhận GPU không
-            if self.device == 0 and not torch.cuda.is_available():
-                print("[WARNING] Đã chọn GPU nhưng Torch không tìm thấy CUDA -> Không được dùng")
-                return
-            else:
-                print(f"Đang sử dụng thiết bị: {self.device}")
-            print(f"[INFO] Đang load model từ {model_path}...")# Tải model
-            self.model = YOLO(model_path,task="detect")
+
+    def _init_model(self, model_path, device, backend, backend_options, worker_config, warmup):
+        # Check nhanh xem máy host có nhận GPU không, không có thì chạy CPU thay vì bỏ trống model
+        self.device = resolve_device(device)
+        print(f"Đang sử dụng thiết bị: {self.device}")
+        if self.device == "cpu" and backend == "ultralytics" and str(model_path).lower().endswith(".onnx"):
+            # Trên CPU chạy thẳng ONNX Runtime (đủ thread, có thể INT8) nhanh hơn qua wrapper Ultralytics
+            print("[INFO] Không có GPU + model .onnx -> chuyển sang backend onnxruntime tối ưu cho CPU")
+            backend = "onnxruntime"
+        self.model_id = f"{backend}:{self._model_identity(model_path)}" if isinstance(backend, str) else self._model_identity(model_path)
+        print(f"[INFO] Đang load model từ {model_path}...")# Tải model
+        # Backend: "ultralytics" (mặc định) / "onnxruntime" / "openvino" hoặc 1 object có hàm predict
+        if worker_config and isinstance(backend, str):
+            # Model chạy trong pool process riêng (VD: {"num_workers": 4}), ảnh truyền qua shared memory
+            self.model = InferencePool(backend, model_path, device=self.device, backend_options=backend_options, **worker_config)
         else:
-            print("Filter đang tắt. Mọi ảnh sẽ được chấp nhận.")
+            self.model = create_backend(backend, model_path, device=self.device, **(backend_options or {}))
+        # 1 instance YOLO / OpenVINO / ORT không an toàn khi gọi song song từ nhiều luồng request -> mọi lần gọi model
+        # đi qua 1 lock (decode, dedup, upload vẫn chạy song song). InferencePool tự chia việc cho các process nên không cần.
+        self._model_lock = nullcontext() if isinstance(self.model, InferencePool) else threading.Lock()
+
+        # Chạy thử trước để request đầu tiên không phải trả giá khởi tạo graph / kernel
+        if warmup:
+            batch_sizes = (1, self.max_batch_size) if self.max_batch_size > 1 else (1,)
+            elapsed = warmup_backend(self.model, batch_sizes)
+            print(f"[INFO] Đã warm-up model ({elapsed * 1000:.0f} ms)")
+
+    @staticmethod
+    def _model_identity(model_path):
+        """Định danh model cho cache: tên file + kích thước + thời điểm sửa, đổi model là cache tự vô hiệu"""
+        if model_path and os.path.exists(model_path):
+            st = os.stat(model_path)
+            return f"{os.path.basename(model_path)}:{st.st_size}:{int(st.st_mtime)}"
+        return str(model_path)
+
+    def _cache_key(self, input_data, custom_targets, mode="full"):
+        targets = self.labels.normalize_targets(custom_targets) if custom_targets else self.target_classes
+        return make_cache_key(input_data, self.model_id, targets, extra=mode)
 
     def _bytes_to_image(self, image_bytes): 
         if not isinstance(image_bytes, (bytes, bytearray)):
             print(f"[Error] Dữ liệu đầu vào không phải là bytes. Nhận được kiểu: {type(image_bytes)}")
-            return None
+            return None, None
 
-        nparr = np.frombuffer(image_bytes, np.uint8) 
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # JPEG lớn được decode thẳng ở độ phân giải giảm (vẫn >= kích thước input của model,
+        # hoặc >= ngưỡng cắt tile khi bật tiling để vật nhỏ không bị mất)
+        target_size = None
+        if self.reduced_decode:
+            target_size = self.tiling.min_side if self.tiling else getattr(self.model, "input_size", 640)
+        with STAGE_SECONDS.time(stage="decode"):
+            img, original_shape = decode_image(image_bytes, target_size)
         if img is None:
             print("[Warning] Dữ liệu bytes không phải là file ảnh hợp lệ hoặc bị hỏng.")
-        return img
-    def _upload_to_minio(self, image_bytes, full_path_name):
+        return img, original_shape
+    def process(self, input_data, metadata=None,custom_targets=None, mode="full"):
         """
-        Upload ảnh lên MinIO.
-        :param full_path_name: Tên file có thể kèm folder (VD: 'keep/image.jpg')
+        :param mode: "full" (đủ detections) hoặc "decision" (chỉ quyết định KEEP/SKIP: lọc class target
+                     ngay trong NMS, conf cao hơn, không dựng chi tiết box)
         """
-        if not self.minio_client:
-            return None
-        
-        try:
-            # Tách thư mục và tên file riêng biệt
-            # VD: "retrain/anh.jpg" -> folder="retrain", filename="anh.jpg"
-            folder, filename = os.path.split(full_path_name)
-            
-            timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-            
-            # folder + timestamp + filename
-            # VD: "retrain" + "20251223_anh.jpg" -> "retrain/20251223_anh.jpg"
-            final_object_name = f"{timestamp_str}_{filename}"
-            if folder:
-                final_object_name = f"{folder}/{final_object_name}"
-            
-            # Tự động đoán Content-Type (image/jpeg hay image/png)
-            content_type, _ = mimetypes.guess_type(filename)
-            if not content_type:
-                content_type = "image/jpeg" # Fallback nếu không đoán được
-
-            # Upload
-            data_stream = io.BytesIO(image_bytes)
-            data_length = len(image_bytes)
-            
-            self.minio_client.put_object(
-                self.bucket_name,
-                final_object_name, # Tên object đã chuẩn hóa
-                data_stream,
-                data_length,
-                content_type=content_type 
-            )
-            
-            # Trả về đường dẫn để lưu vào MongoDB
-            return final_object_name
-            
-        except Exception as e:
-            print(f"❌ [MINIO ERROR] Upload thất bại: {e}")
-            return None
-
-    def process(self, input_data, metadata=None,custom_targets=None):
         # check cờ tắt/bật
         if not self.enable_filter:
             return True, [], [], "BYPASSED"
 
+        result, job = self._prepare(input_data, metadata, custom_targets, mode)
+        if job is None:
+            return result
+        
+        # Inference (qua batcher nếu có để gom với các request khác)
+        params = self._predict_params(custom_targets, mode)
+        # Tính cả thời gian chờ gom batch
+        with STAGE_SECONDS.time(stage="inference"):
+            if self.batcher:
+                detailed_info = self.batcher.predict(job["img"], **params)
+            else:
+                detailed_info = self.predict_batch([job["img"]], **params)[0]
+
+        return self._complete(job, detailed_info)
+
+    def process_batch(self, inputs, metadatas=None, custom_targets=None, mode="full"):
+        """
+        Xử lý nhiều ảnh trong 1 lần: decode, chạy model theo từng batch (max_batch_size ảnh),
+        rồi quyết định/lưu/ghi log từng ảnh như process().
+        Trả về list tuple (is_valid, labels, details, action) đúng thứ tự đầu vào.
+        """
+        inputs = list(inputs)
+        metadatas = list(metadatas) if metadatas else [None] * len(inputs)
+        if not self.enable_filter:
+            return [(True, [], [], "BYPASSED") for _ in inputs]
+
+        results = [None] * len(inputs)
+        # Decode theo từng chunk để không giữ toàn bộ ảnh đã decode trong RAM
+        for start in range(0, len(inputs), self.max_batch_size):
+            jobs = []
+            for i in range(start, min(start + self.max_batch_size, len(inputs))):
+                result, job = self._prepare(inputs[i], metadatas[i], custom_targets, mode)
+                if job is None:
+                    results[i] = result
+                else:
+                    jobs.append((i, job))
+            if not jobs:
+                continue
+
+            params = self._predict_params(custom_targets, mode)
+            with STAGE_SECONDS.time(stage="inference"):
+                if self.batcher:
+                    # Đi qua batcher như process(): không gọi model song song với các request khác
+                    futures = [self.batcher.submit(job["img"], **params) for _, job in jobs]
+                    detections = [future.result() for future in futures]
+                else:
+                    detections = self.predict_batch([job["img"] for _, job in jobs], **params)
+            for (i, job), detailed_info in zip(jobs, detections):
+                results[i] = self._complete(job, detailed_info)
+        return results
+
+    def _predict_params(self, custom_targets, mode):
+        if mode != "decision":
+            return {}
+        return {"mode": mode, "targets": self.labels.normalize_targets(custom_targets) if custom_targets else self.target_classes}
+
+    def _prepare(self, input_data, metadata, custom_targets, mode="full"):
+        """
+        Các bước trước inference: cache -> decode -> tìm ảnh gần trùng.
+        Trả về (kết quả, None) nếu đã có kết quả mà không cần chạy model,
+        ngược lại trả về (None, job) với job chứa ảnh đã decode.
+        """
+        # Ảnh đã xử lý trước đó (cùng bytes, cùng model, cùng target) -> bỏ qua decode + inference
+        cache_key = None
+        if self.result_cache and isinstance(input_data, (bytes, bytearray)):
+            cache_key = self._cache_key(input_data, custom_targets, mode)
+            detailed_info = self.result_cache.get(cache_key)
+            if detailed_info is not None:
+                # Cùng bytes ảnh đã được lưu lên MinIO ở lần xử lý trước -> không upload lại
+                return self._finalize(input_data, metadata, custom_targets, detailed_info, log_extra={"cache_hit": True}, store_image=False, decision=mode == "decision"), None
+
         # Decode ảnh
-        img_numpy = self._bytes_to_image(input_data)
+        img_numpy, original_shape = self._bytes_to_image(input_data)
         if img_numpy is None:
-            self._log_to_mongo(metadata,detected_labels=[], is_valid=False, action="UNPROCESSED", reason="Invalid Image Data (Decode Failed)")
-            return False, [], "Image decode failed", "ERROR"
-        
-        # Inference
-        results = self.model(img_numpy, conf=0.1, verbose=False)
-        detailed_info = []
-        detected_labels = set()
-        
+            return self._decode_failed(metadata), None
+
+        # Bản sao đã bị resize / nén lại của ảnh cũ -> dùng lại detections, không lưu ảnh lần nữa
+        image_hash = None
+        if self.dedup_index:
+            with STAGE_SECONDS.time(stage="dedup"):
+                image_hash = self.dedup_index.compute(img_numpy)
+                found = self.dedup_index.lookup(image_hash)
+            if found:
+                distance, entry = found
+                if mode == "decision":
+                    # Detections lưu sẵn là kết quả full -> chỉ giữ class target như 1 lần chạy decision thật
+                    detailed_info = self._decision_from_full(entry["detections"], custom_targets)
+                else:
+                    detailed_info = rescale_detections(entry["detections"], entry["shape"], original_shape)
+                duplicate_of = {"filename": entry["filename"], "distance": distance, "phash": format(image_hash, "016x")}
+                return self._finalize(input_data, metadata, custom_targets, detailed_info, log_extra={"duplicate_of": duplicate_of}, store_image=False, decision=mode == "decision"), None
+
+        # Cascade: ảnh bị tầng lọc trước loại thì không chạy detector (và không cache kết quả)
+        cascade_info = None
+        if self.cascade:
+            with STAGE_SECONDS.time(stage="cascade"):
+                cascade_info = self.cascade.check(img_numpy)
+            if cascade_info["rejected"]:
+                verdict = (self.cascade.reject_action, f"Rejected by Cascade: {cascade_info['reason']}")
+                return self._finalize(input_data, metadata, custom_targets, [], log_extra={"cascade": cascade_info}, verdict=verdict), None
+
+        return None, {
+            "input_data": input_data,
+            "metadata": metadata,
+            "custom_targets": custom_targets,
+            "mode": mode,
+            "img": img_numpy,
+            "shape": original_shape,
+            "cache_key": cache_key,
+            "image_hash": image_hash,
+            "cascade": cascade_info
+        }
+
+    def _complete(self, job, detailed_info):
+        """Các bước sau inference: lưu cache / chỉ mục trùng lặp rồi quyết định + ghi log"""
+        decision = job["mode"] == "decision"
+        # Ảnh được decode ở độ phân giải giảm -> đưa box về tọa độ ảnh gốc
+        if not decision:
+            detailed_info = rescale_detections(detailed_info, job["img"].shape[:2], job["shape"])
+        if job["cache_key"]:
+            self.result_cache.set(job["cache_key"], detailed_info)
+        # Kết quả decision-only không đủ box để dùng lại cho ảnh gần trùng
+        if job["image_hash"] is not None and not decision:
+            metadata = job["metadata"] or {}
+            self.dedup_index.add(job["image_hash"], {
+                "detections": detailed_info,
+                "shape": job["shape"],
+                "filename": metadata.get("filename", "unknown")
+            })
+        log_extra = {"cascade": job["cascade"]} if job["cascade"] else None
+        return self._finalize(job["input_data"], job["metadata"], job["custom_targets"], detailed_info, log_extra=log_extra, decision=decision)
+
+    def _decode_failed(self, metadata):
+        self.log_handler(metadata=metadata, detected_labels=[], is_valid=False, action="UNPROCESSED", reason="Invalid Image Data (Decode Failed)")
+        meta = metadata or {}
+        IMAGES_TOTAL.inc(action="ERROR", user=meta.get("user", "unknown"), source=meta.get("api_source", "unknown"))
+        return False, [], "Image decode failed", "ERROR"
+
+    def predict_batch(self, images, mode="full", targets=None):
+        """
+        Chạy model trên nhiều ảnh trong 1 lần gọi.
+        Trả về list detections, phần tử thứ i ứng với ảnh thứ i.
+        """
+        if mode == "decision":
+            # Chỉ giữ class target ngay trong NMS, conf cao hơn, vài box là đủ để quyết định
+            classes = self.labels.ids_of(targets or self.target_classes).tolist()
+            outputs = self._predict(list(images), conf=self.decision_config["conf"], classes=classes, max_det=self.decision_config["max_det"])
+            return [self._decision_result(dets) for dets in outputs]
+        outputs = self._predict(list(images), conf=0.1)
+        return [self._parse_result(dets) for dets in outputs]
+
+    def _predict(self, images, max_det=300, **params):
+        INFERENCE_BATCH_SIZE.observe(len(images))
+        with STAGE_SECONDS.time(stage="model"):
+            return self._run_model(images, max_det=max_det, **params)
+
+    def _run_model(self, images, max_det=300, **params):
+        with self._model_lock:
+            return self._call_model(images, max_det=max_det, **params)
+
+    def _call_model(self, images, max_det=300, **params):
+        if self.tiling:
+            # Tile của cả batch chạy chung, mỗi lần gọi model chứa đủ tile của ít nhất 1 ảnh
+            return self.tiling.predict(self.model.predict, images, chunk_size=max(self.max_batch_size, self.tiling.max_tiles + 1), max_det=max_det, **params)
+        return self.model.predict(images, max_det=max_det, **params)
+
+    def _decision_from_full(self, detailed_info, custom_targets):
+        """Detections đầy đủ -> dạng kết quả decision-only (chỉ tên class target, cùng ngưỡng conf)"""
+        targets = self.labels.normalize_targets(custom_targets) if custom_targets else self.target_classes
+        conf = self.decision_config["conf"]
+        cls_ids = np.unique(self.labels.class_ids_of([d for d in detailed_info if d.get("confidence", 1.0) >= conf]))
+        if len(cls_ids) == 0:
+            return []
+        return self._decision_result_from_ids(cls_ids[self.labels.mask(targets)[cls_ids]])
+
+    def _decision_result(self, dets):
+        """Chỉ lấy tên các class target có mặt, không dựng box / confidence cho từng detection"""
+        if len(dets) == 0:
+            return []
+        return self._decision_result_from_ids(np.unique(np.asarray(dets)[:, 5].astype(np.int64)))
+
+    def _decision_result_from_ids(self, cls_ids):
+        labels = self.labels.labels_of(cls_ids)
+        return sorted(({"object": label, "class_id": int(i)} for label, i in zip(labels, cls_ids)), key=lambda d: d["object"])
+
+    def _parse_result(self, dets):
+        """Chuyển mảng (N, 6) [x1, y1, x2, y2, conf, cls] của 1 ảnh thành list dict {object, class_id, confidence, box}"""
+        if len(dets) == 0:
+            return []
+        dets = np.asarray(dets, dtype=np.float64)
+        cls_ids = dets[:, 5].astype(np.int64)
+        labels = self.labels.labels_of(cls_ids)
+        confs = np.round(dets[:, 4], 2).tolist()
+        boxes = np.round(dets[:, :4], 1).tolist()
+        return [{"object": label, "class_id": int(i), "confidence": conf, "box": box} for label, i, conf, box in zip(labels, cls_ids, confs, boxes)]
+
+    def _finalize(self, input_data, metadata, custom_targets, detailed_info, log_extra=None, store_image=True, decision=False, verdict=None):
+        """
+        Từ detections -> quyết định KEEP/SKIP/UNPROCESSED, lưu ảnh, ghi log, cập nhật thống kê.
+        :param log_extra: các trường bổ sung ghi thêm vào log
+        :param store_image: False để không lưu ảnh (VD: ảnh trùng đã lưu trước đó)
+        :param decision: True nếu detections đến từ chế độ decision-only (model chỉ tìm class target)
+        :param verdict: (action, reason) đã quyết định trước (VD: ảnh bị cascade loại)
+        """
         # Lấy danh sách tên class phát hiện được
-        for result in results:
-            for box in result.boxes:
-                cls_id = int(box.cls[0])
-                conf = float(box.conf[0])
-                box_coords = box.xyxy[0].tolist() # box.xyxy trả về tensor [x1, y1, x2, y2], cần chuyển sang list
-                box_coords = [round(x, 1) for x in box_coords]
-                
-                label_name = str(cls_id)
-                if self.class_mapping:
-                    label_name = self.class_mapping.get(cls_id, str(cls_id))
-                elif hasattr(self.model, 'names'):
-                    label_name = self.model.names.get(cls_id, str(cls_id))
-                detailed_info.append({
-                    "object": label_name,
-                    "confidence": round(conf, 2),
-                    "box": box_coords   
-                })
-                
-                detected_labels.add(label_name)
+        detected_labels = set(d["object"] for d in detailed_info)
         
         # Model trả về None (Không phát hiện gì hoặc confidence thấp)
         action_result = ""
         is_valid_result = False # Default
         reason_msg = ""
-        if not detected_labels:
+        if verdict:
+            action_result, reason_msg = verdict
+        elif not detected_labels and decision:
+            # Model chỉ tìm class target nên không phân biệt được "không có gì" với "có vật khác"
+            action_result = "SKIP"
+            reason_msg = "No Target Classes Detected (Decision Mode)"
+        elif not detected_labels:
             action_result = "UNPROCESSED"
             reason_msg = "No Objects Detected"
         else:
-            if custom_targets:
-                targets_to_check = set(custom_targets)
-            else:
-                targets_to_check = self.target_classes
-
-            intersect = detected_labels.intersection(targets_to_check)
-            is_valid_result = bool(intersect)
+            # Tra mask class id của tập target (mask của custom_targets được cache theo tổ hợp)
+            class_ids = self.labels.class_ids_of(detailed_info)
+            matched = self.labels.match(class_ids, custom_targets or self.target_classes)
+            is_valid_result = bool(matched)
             
             if is_valid_result:
                 action_result = "KEEP"
@@ -190,81 +452,62 @@ class ImageFilter:
                 action_result = "SKIP"
                 reason_msg = "Objects detected but NOT in Target"
                 
-        minio_path = None        
-        if input_data:
+        save_name = ""
+        if input_data and store_image:
             filename = metadata.get("filename", "unknown.jpg") if metadata else "unknown.jpg"
-            save_name = ""
             if action_result == "KEEP":
                 # Thêm prefix "dataset/" vào trước tên file
                 save_name = f"keep/{filename}" 
-                # minio_path = self._upload_to_minio(input_data, save_name)
                 
             # Ảnh model mù (UNPROCESSED)
             elif action_result == "UNPROCESSED":
                 # Thêm prefix "retrain/" để gom riêng ra
                 save_name = f"unprocessed/{filename}"
-                # minio_path = self._upload_to_minio(input_data, save_name)
             # Model đã được học rồi nên skip
             else:
                 save_name = f"skip/{filename}"
-            
-            if save_name:
-                minio_path = self.image_handler(input_data,save_name)
+
         # Ghi log mọi case vào MongoDB
-        self.log_handler(
+        log_kwargs = dict(
             metadata=metadata,
             detected_labels=list(detected_labels),
             detections_detail=detailed_info,
             is_valid=is_valid_result,
             action=action_result,
             reason=reason_msg,
-            minio_object_name=minio_path
+            **(log_extra or {})
         )
+        if save_name and isinstance(self.image_handler, MinioUploader):
+            # Upload nền: log được ghi sau khi upload xong để điền đúng minio_image_path
+            self.image_handler.submit(input_data, save_name, on_done=lambda path: self.log_handler(minio_object_name=path, **log_kwargs))
+        else:
+            minio_path = self.image_handler(input_data, save_name) if save_name else None
+            self.log_handler(minio_object_name=minio_path, **log_kwargs)
         
         # Update thống kê (chỉ cộng nếu là target)
+        meta = metadata or {}
+        IMAGES_TOTAL.inc(action=action_result, user=meta.get("user", "unknown"), source=meta.get("api_source", "unknown"))
         if is_valid_result:
-            for label in detected_labels.intersection(self.target_classes):
-                if label in self.stats: 
-                    self.stats[label] += 1
+            for label in (self.labels.match(class_ids, self.target_classes) if custom_targets else matched):
+                if label in self.target_classes:
+                    TARGET_LABELS_TOTAL.inc(label=label)
 
         return is_valid_result, list(detected_labels), detailed_info , action_result
 
-    def _log_to_mongo(self, metadata, action, detected_labels=None, detections_detail=None,is_valid=False, reason=None, minio_object_name=None):
-        """
-        Ghi log chi tiết mọi request vào MongoDB để phục vụ Dashboard.
-        """
-        try:
-            # Xử lý Metadata
-            meta = metadata or {}
-            
-            # Lôi thông tin quan trọng ra ngoài
-            user_name = meta.get("user", "Anonymous")
-            source = meta.get("api_source", "unknown")
-            filename = meta.get("filename", "unknown")
-
-            # Tạo document cấu trúc phẳng
-            doc = {
-                "timestamp": datetime.now(),       # Thời gian server nhận ảnh
-                "user": user_name,                 
-                "source": source,
-                "filename": filename,
-                "is_valid": is_valid,              # Kết quả logic: True/False
-                "action": action,                  # Hành động: KEEP/DISCARD -> Mở rộng thêm như UNPROCESSED để xử lý sau
-                "detected_labels": detected_labels if detected_labels else [],
-                "detections_detail": detections_detail if detections_detail else [],
-                "reason": reason,
-                "minio_image_path": minio_object_name, # Lưu tên file trên MinIO
-                "storage_type": "minio" if minio_object_name else "none",        
-                "raw_metadata": meta
-            }
-
-            # Insert vào Database
-            self.collection.insert_one(doc)
-            print(f"[MONGO] ✅ Đã lưu log user: {user_name} | Labels: {detected_labels}")
-
-        except Exception as e:
-            print(f"[ERROR] ❌ Lỗi khi lưu MongoDB: {e}")
-
     def get_stats(self):
         """Trả về thống kê số lượng đã thu thập"""
-        return self.stats
\ No newline at end of file
+        return {label: TARGET_LABELS_TOTAL.value(label=label) for label in sorted(self.target_classes)}
+
+    def close(self):
+        """Giải phóng các worker chạy nền (gọi khi tắt server)"""
+        if self.batcher:
+            self.batcher.close()
+        if isinstance(self.model, InferencePool):
+            self.model.close()
+        # Upload xong trước rồi mới đóng log writer, vì log được ghi sau khi upload
+        if self.uploader:
+            self.uploader.close()
+        if self.log_writer:
+            self.log_writer.close()
+        if self.result_cache:
+            self.result_cache.close()
\ No newline at end of file
@@ -0,0 +1,112 @@
+import re
+import threading
+from collections import OrderedDict
+import numpy as np #type: ignore
+
+# Các tên nhãn viết khác nhau nhưng cùng 1 vật thể -> tên chuẩn
+DEFAULT_SYNONYMS = {
+    "scissors": "scissor",
+    "calender": "calendar",
+    "sanwich": "sandwich",
+    "paper note": "note paper",
+    "giấy note": "note paper",
+}
+
+
+class LabelSpace:
+    """
+    Không gian nhãn của model: id -> tên chuẩn (đã gộp từ đồng nghĩa / sai chính tả) và
+    mask bool theo class id cho từng tập target, để quyết định KEEP/SKIP bằng 1 phép tra mask.
+    Tên chuẩn chỉ dùng để so với target; nhãn trả về cho client (labels_of) vẫn là tên gốc của model.
+
+    - names: dict {class_id: tên} (CLASS_MAPPING hoặc names của model)
+    - synonyms: dict {tên phụ: tên chuẩn}
+    - max_cached_masks: số tổ hợp custom_targets được giữ mask đã dựng sẵn (LRU)
+    """
+    def __init__(self, names=None, synonyms=None, max_cached_masks=128):
+        self.synonyms = {self._clean(k): self._clean(v) for k, v in (DEFAULT_SYNONYMS if synonyms is None else synonyms).items()}
+        self.max_cached_masks = max_cached_masks
+        self._raw_names = dict(names or {})
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+        self._build(max(self._raw_names, default=-1) + 1)
+
+    @staticmethod
+    def _clean(name):
+        return re.sub(r"[\s_]+", " ", str(name).strip().lower())
+
+    def normalize(self, name):
+        """Tên bất kỳ -> tên chuẩn"""
+        name = self._clean(name)
+        return self.synonyms.get(name, name)
+
+    def normalize_targets(self, targets):
+        return frozenset(self.normalize(t) for t in targets)
+
+    def _build(self, size):
+        raw_names = [str(self._raw_names[i]) if i in self._raw_names else str(i) for i in range(size)]
+        names = [self.normalize(name) for name in raw_names]
+        ids_by_name = {}
+        for i, name in enumerate(names):
+            ids_by_name.setdefault(name, []).append(i)
+        # Gán cả bảng 1 lần để các luồng khác luôn thấy trạng thái nhất quán
+        self.raw_names = np.array(raw_names, dtype=object)
+        self.names = np.array(names, dtype=object)
+        self.ids_by_name = ids_by_name
+        self.num_classes = size
+
+    def _ensure(self, class_ids):
+        """Mở rộng bảng khi model trả về class id lớn hơn số tên đã biết"""
+        if len(class_ids) and int(class_ids.max()) >= self.num_classes:
+            with self._lock:
+                if int(class_ids.max()) >= self.num_classes:
+                    self._build(int(class_ids.max()) + 1)
+                    self._masks.clear()
+
+    def labels_of(self, class_ids):
+        """Mảng class id -> list tên gốc của model"""
+        self._ensure(class_ids)
+        return self.raw_names[class_ids].tolist()
+
+    def ids_of(self, labels):
+        """Tên nhãn -> mảng class id (1 tên chuẩn có thể ứng với nhiều id)"""
+        ids = [i for label in labels for i in self.ids_by_name.get(self.normalize(label), ())]
+        return np.array(sorted(set(ids)), dtype=np.int64)
+
+    def mask(self, targets):
+        """Mask bool (num_classes,) của 1 tập target, dựng 1 lần rồi giữ trong LRU"""
+        key = targets if isinstance(targets, frozenset) else self.normalize_targets(targets)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        mask = np.zeros(self.num_classes, dtype=bool)
+        mask[self.ids_of(key)] = True
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.max_cached_masks:
+                self._masks.popitem(last=False)
+        return mask
+
+    def class_ids_of(self, detections):
+        """
+        List detection dict -> mảng class id. Detection thiếu "class_id" (kết quả cache từ phiên bản cũ)
+        thì tra theo tên, tên không có trong bảng bị bỏ qua.
+        """
+        ids = []
+        for d in detections:
+            if "class_id" in d:
+                ids.append(int(d["class_id"]))
+            else:
+                ids.extend(self.ids_by_name.get(self.normalize(d["object"]), ())[:1])
+        return np.array(ids, dtype=np.int64)
+
+    def match(self, class_ids, targets):
+        """Trả về list tên chuẩn của các target có trong mảng class id (rỗng -> không khớp)"""
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        if not len(class_ids):
+            return []
+        self._ensure(class_ids)
+        mask = self.mask(targets)
+        return sorted(set(self.names[class_ids[mask[class_ids]]].tolist()))
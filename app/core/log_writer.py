@@ -0,0 +1,157 @@
+import threading
+import queue
+import time
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING #type: ignore
+from pymongo.errors import BulkWriteError #type: ignore
+from app.core.metrics import STAGE_SECONDS
+
+
+def build_log_document(metadata, action, detected_labels=None, detections_detail=None, is_valid=False, reason=None, minio_object_name=None, **extra):
+    """Tạo document log phẳng cho Dashboard từ kết quả của 1 request"""
+    # Xử lý Metadata
+    meta = metadata or {}
+
+    doc = {
+        "timestamp": datetime.now(),       # Thời gian server nhận ảnh
+        "user": meta.get("user", "Anonymous"),
+        "source": meta.get("api_source", "unknown"),
+        "filename": meta.get("filename", "unknown"),
+        "is_valid": is_valid,              # Kết quả logic: True/False
+        "action": action,                  # Hành động: KEEP/SKIP/UNPROCESSED/ERROR
+        "detected_labels": detected_labels if detected_labels else [],
+        "detections_detail": detections_detail if detections_detail else [],
+        "reason": reason,
+        "minio_image_path": minio_object_name, # Lưu tên file trên MinIO
+        "storage_type": "minio" if minio_object_name else "none",
+        "raw_metadata": meta
+    }
+    # Các trường bổ sung (VD: thông tin trùng lặp, cascade...)
+    doc.update(extra)
+    return doc
+
+
+# Chỉ mục của collection log (log server + kết quả batch_test):
+# - source/status/filename: tra ảnh đã chạy xong khi resume batch_test (covered query)
+# - timestamp: Dashboard lọc log theo khoảng thời gian
+# - source/timestamp: Dashboard lấy kết quả test mới nhất theo source
+LOG_INDEXES = [
+    ([("source", ASCENDING), ("status", ASCENDING), ("filename", ASCENDING)], "source_status_filename"),
+    ([("timestamp", DESCENDING)], "timestamp"),
+    ([("source", ASCENDING), ("timestamp", DESCENDING)], "source_timestamp"),
+]
+
+
+def ensure_log_indexes(collection):
+    """Tạo các chỉ mục của collection log nếu chưa có (create_index idempotent, gọi mỗi lần khởi động)"""
+    for keys, name in LOG_INDEXES:
+        collection.create_index(keys, name=name)
+
+
+class MongoLogWriter:
+    """
+    Ghi log xuống MongoDB ở luồng nền: gom document rồi insert_many(ordered=False)
+    khi đủ batch_size hoặc sau flush_interval giây.
+
+    Có thể truyền trực tiếp làm log_handler cho ImageFilter (cùng chữ ký keyword).
+    - max_queue: số document tối đa đang chờ ghi
+    - block_timeout: số giây chờ khi hàng đợi đầy trước khi bỏ document (0 = bỏ ngay)
+    """
+    def __init__(self, collection, batch_size=100, flush_interval=1.0, max_queue=10000, block_timeout=0):
+        self.collection = collection
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.block_timeout = float(block_timeout)
+        self.stats = {"written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="mongo-log-writer", daemon=True)
+        self._worker.start()
+
+    def __call__(self, metadata, action, detected_labels=None, detections_detail=None, is_valid=False, reason=None, minio_object_name=None, **extra):
+        self.submit(build_log_document(
+            metadata, action,
+            detected_labels=detected_labels,
+            detections_detail=detections_detail,
+            is_valid=is_valid,
+            reason=reason,
+            minio_object_name=minio_object_name,
+            **extra
+        ))
+
+    def submit(self, doc):
+        """Đưa document vào hàng đợi. Trả về False nếu bị bỏ do hàng đợi đầy."""
+        if self._closed:
+            return self._drop()
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(doc, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(doc)
+            return True
+        except queue.Full:
+            return self._drop()
+
+    def _drop(self):
+        with self._lock:
+            self.stats["dropped"] += 1
+            dropped = self.stats["dropped"]
+        # Chỉ in cảnh báo thưa thớt để không làm ngập console
+        if dropped == 1 or dropped % 1000 == 0:
+            print(f"[WARNING] Hàng đợi log MongoDB đầy, đã bỏ {dropped} document")
+        return False
+
+    @property
+    def depth(self):
+        """Số document đang chờ ghi"""
+        return self._queue.qsize()
+
+    def _run(self):
+        buffer = []
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+        while not stop:
+            try:
+                doc = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if doc is None:
+                    stop = True
+                else:
+                    buffer.append(doc)
+            except queue.Empty:
+                pass
+
+            if buffer and (stop or len(buffer) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(buffer)
+                buffer = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, docs):
+        started = time.perf_counter()
+        try:
+            result = self.collection.insert_many(docs, ordered=False)
+            written = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # ordered=False: các document hợp lệ vẫn được ghi, chỉ đếm số bị lỗi
+            written = e.details.get("nInserted", 0)
+            print(f"[ERROR] ❌ Lỗi khi ghi {len(docs) - written}/{len(docs)} log MongoDB: {e}")
+        except Exception as e:
+            written = 0
+            print(f"[ERROR] ❌ Lỗi khi lưu MongoDB: {e}")
+
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="mongo_write")
+        with self._lock:
+            self.stats["written"] += written
+            self.stats["failed"] += len(docs) - written
+            self.stats["flushes"] += 1
+
+    def close(self, timeout=10):
+        """Ngừng nhận log mới và ghi hết những gì còn trong hàng đợi"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout=timeout)
+        print(f"[MONGO] Đã đóng log writer | Đã ghi: {self.stats['written']} | Bỏ: {self.stats['dropped']} | Lỗi: {self.stats['failed']}")
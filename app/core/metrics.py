@@ -0,0 +1,136 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Các metric tự đăng ký vào đây khi tạo, /metrics render toàn bộ theo định dạng text của Prometheus
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=(), max_series=1000):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        # Nhãn do client gửi lên (VD: source) có thể vô hạn giá trị -> gộp phần vượt quá vào "other"
+        if key not in self._series and len(self._series) >= self.max_series:
+            key = ("other",) * len(self.labelnames)
+        return key
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+
+class Gauge(_Metric):
+    """Gauge đọc giá trị lúc render qua hàm callback (VD: độ dài hàng đợi)"""
+    type_name = "gauge"
+
+    def set_function(self, fn, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = fn
+
+    def _render_series(self, key, fn):
+        try:
+            value = fn()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=1000):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # [số lần rơi vào từng bucket (+Inf ở cuối), tổng, số lần]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, series):
+        counts, total, count = series
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = 'le="' + ("+Inf" if bound == float("inf") else repr(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render():
+    """Toàn bộ metric theo định dạng text exposition của Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metric dùng chung của service
+STAGE_SECONDS = Histogram("filter_stage_seconds", "Thời gian từng bước xử lý ảnh (giây)", ["stage"])
+REQUEST_SECONDS = Histogram("filter_request_seconds", "Thời gian xử lý request theo endpoint (giây)", ["endpoint"])
+IMAGES_TOTAL = Counter("filter_images_total", "Số ảnh đã xử lý theo action / user / source", ["action", "user", "source"])
+TARGET_LABELS_TOTAL = Counter("filter_target_labels_total", "Số ảnh KEEP theo nhãn target", ["label"])
+INFERENCE_BATCH_SIZE = Histogram("filter_inference_batch_size", "Số ảnh mỗi lần gọi model", buckets=(1, 2, 4, 8, 16, 32, 64))
+RESULT_CACHE_TOTAL = Counter("filter_result_cache_total", "Số lần tra / đẩy entry của cache kết quả theo sự kiện (hit, shared_hit, miss, eviction, expired)", ["event"])
+QUEUE_DEPTH = Gauge("filter_queue_depth", "Số việc đang chờ trong các hàng đợi nội bộ", ["queue"])
@@ -0,0 +1,86 @@
+import math
+import numpy as np #type: ignore
+from app.core.backends import batched_nms, EMPTY_DETECTIONS
+
+
+class SlicedInference:
+    """
+    Suy luận theo tile cho ảnh lớn: cắt ảnh thành các tile chồng lấn nhau, chạy cùng ảnh toàn cảnh
+    trong 1 batch, dịch box về tọa độ ảnh rồi NMS chung để bỏ box trùng giữa các tile.
+    Vật nhỏ (bút, kẹp giấy, tẩy...) không bị mất khi ảnh 4000px bị thu về 640px.
+
+    - tile_size: cạnh tile (px ảnh gốc), nên bằng kích thước input của model
+    - overlap: tỉ lệ chồng lấn giữa 2 tile liền kề
+    - min_side: chỉ cắt tile khi cạnh dài của ảnh >= min_side, ảnh nhỏ hơn chạy như bình thường
+    - max_tiles: số tile tối đa / ảnh (không tính ảnh toàn cảnh); vượt quá thì tile được nới to ra
+    - include_full: chạy thêm ảnh toàn cảnh để giữ các vật lớn bị cắt ngang giữa các tile
+    """
+    def __init__(self, tile_size=640, overlap=0.2, min_side=1600, max_tiles=8, include_full=True, iou=0.45):
+        self.tile_size = int(tile_size)
+        self.overlap = float(overlap)
+        self.min_side = int(min_side)
+        self.max_tiles = max(1, int(max_tiles))
+        self.include_full = include_full
+        self.iou = iou
+        self.stats = {"images": 0, "tiled_images": 0, "tiles": 0}
+
+    def plan(self, shape):
+        """Danh sách vùng (x1, y1, x2, y2) cần chạy cho ảnh có shape (h, w)"""
+        h, w = shape[:2]
+        if max(h, w) < self.min_side:
+            return [(0, 0, w, h)]
+
+        tile = self.tile_size
+        while True:
+            stride = max(1, int(tile * (1 - self.overlap)))
+            nx = 1 if w <= tile else math.ceil((w - tile) / stride) + 1
+            ny = 1 if h <= tile else math.ceil((h - tile) / stride) + 1
+            if nx * ny <= self.max_tiles:
+                break
+            tile = int(tile * 1.25)
+
+        # Tile cuối cùng căn sát mép ảnh thay vì thò ra ngoài
+        xs = [min(i * stride, max(w - tile, 0)) for i in range(nx)]
+        ys = [min(i * stride, max(h - tile, 0)) for i in range(ny)]
+        regions = [(x, y, min(x + tile, w), min(y + tile, h)) for y in ys for x in xs]
+        if self.include_full:
+            regions.insert(0, (0, 0, w, h))
+        return regions
+
+    def predict(self, predict_fn, images, chunk_size=16, max_det=300, **params):
+        """
+        Chạy predict_fn(list crop, **params) trên toàn bộ tile của các ảnh (theo từng chunk),
+        trả về mảng detections (N, 6) theo tọa độ ảnh cho từng ảnh.
+        """
+        crops, owners = [], []
+        for i, img in enumerate(images):
+            regions = self.plan(img.shape)
+            for x1, y1, x2, y2 in regions:
+                crops.append(img[y1:y2, x1:x2])
+                owners.append((i, x1, y1))
+            self.stats["images"] += 1
+            if len(regions) > 1:
+                self.stats["tiled_images"] += 1
+                self.stats["tiles"] += len(regions)
+
+        outputs = []
+        for start in range(0, len(crops), max(1, chunk_size)):
+            outputs.extend(predict_fn(crops[start:start + chunk_size], max_det=max_det, **params))
+
+        per_image = [[] for _ in images]
+        for (i, x, y), dets in zip(owners, outputs):
+            if len(dets):
+                dets = np.array(dets, dtype=np.float32)
+                dets[:, [0, 2]] += x
+                dets[:, [1, 3]] += y
+                per_image[i].append(dets)
+        results = []
+        for parts in per_image:
+            if not parts:
+                results.append(EMPTY_DETECTIONS)
+            elif len(parts) == 1:
+                results.append(parts[0])
+            else:
+                # NMS chung: box của cùng 1 vật ở vùng chồng lấn / ở ảnh toàn cảnh chỉ giữ 1
+                results.append(batched_nms(np.concatenate(parts, axis=0), self.iou, max_det))
+        return results
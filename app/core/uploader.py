@@ -0,0 +1,149 @@
+import io
+import os
+import mimetypes
+import threading
+import queue
+import time
+from datetime import datetime
+from minio.error import S3Error #type: ignore
+from app.core.metrics import STAGE_SECONDS
+
+# Các mã lỗi S3 không có ý nghĩa khi thử lại (sai quyền, sai bucket...)
+PERMANENT_S3_ERRORS = {"AccessDenied", "NoSuchBucket", "InvalidAccessKeyId", "SignatureDoesNotMatch", "InvalidBucketName"}
+
+
+def build_object_name(full_path_name):
+    """
+    Chuẩn hóa tên object trên MinIO và đoán Content-Type.
+    VD: "keep/anh.jpg" -> ("keep/20251223_101500_anh.jpg", "image/jpeg")
+    """
+    # Tách thư mục và tên file riêng biệt
+    folder, filename = os.path.split(full_path_name)
+    timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # folder + timestamp + filename
+    final_object_name = f"{timestamp_str}_{filename}"
+    if folder:
+        final_object_name = f"{folder}/{final_object_name}"
+
+    # Tự động đoán Content-Type (image/jpeg hay image/png)
+    content_type, _ = mimetypes.guess_type(filename)
+    if not content_type:
+        content_type = "image/jpeg" # Fallback nếu không đoán được
+    return final_object_name, content_type
+
+
+class MinioUploader:
+    """
+    Hàng đợi upload ảnh lên MinIO chạy nền với nhiều worker, để request không phải chờ put_object.
+
+    - client: Minio client (hoặc object bất kỳ có put_object cùng chữ ký, tiện cho test)
+    - num_workers: số luồng upload song song
+    - max_retries / backoff: thử lại lỗi tạm thời, thời gian chờ tăng gấp đôi sau mỗi lần
+    - part_size: kích thước mỗi part khi upload multipart (tối thiểu 5MB theo S3)
+
+    Có thể truyền làm image_handler: gọi trực tiếp sẽ trả về tên object dự kiến.
+    """
+    def __init__(self, client, bucket_name, num_workers=4, max_queue=1000, max_retries=3, backoff=0.5, part_size=10 * 1024 * 1024, block_timeout=0):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = float(backoff)
+        self.part_size = int(part_size)
+        self.block_timeout = float(block_timeout)
+        self.stats = {"uploaded": 0, "failed": 0, "retries": 0, "dropped": 0}
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = []
+        for i in range(max(1, int(num_workers))):
+            worker = threading.Thread(target=self._run, name=f"minio-uploader-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def __call__(self, image_bytes, full_path_name):
+        return self.submit(image_bytes, full_path_name)
+
+    def submit(self, image_bytes, full_path_name, on_done=None):
+        """
+        Xếp ảnh vào hàng đợi upload.
+        :param on_done: callback(object_name) gọi sau khi upload xong; object_name=None nếu thất bại
+        :return: Tên object dự kiến trên MinIO, hoặc None nếu hàng đợi đầy
+        """
+        object_name, content_type = build_object_name(full_path_name)
+        job = (image_bytes, object_name, content_type, on_done)
+        try:
+            if self._closed:
+                raise queue.Full
+            if self.block_timeout > 0:
+                self._queue.put(job, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("dropped")
+            print(f"[WARNING] Hàng đợi upload MinIO đầy, bỏ qua ảnh: {object_name}")
+            self._notify(on_done, None)
+            return None
+        return object_name
+
+    @property
+    def depth(self):
+        """Số ảnh đang chờ upload"""
+        return self._queue.qsize()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _notify(self, on_done, object_name):
+        if not on_done:
+            return
+        try:
+            on_done(object_name)
+        except Exception as e:
+            print(f"[ERROR] ❌ Lỗi trong callback sau upload: {e}")
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            image_bytes, object_name, content_type, on_done = job
+            with STAGE_SECONDS.time(stage="minio_upload"):
+                uploaded = self._upload_with_retry(image_bytes, object_name, content_type)
+            self._notify(on_done, object_name if uploaded else None)
+
+    def _upload_with_retry(self, image_bytes, object_name, content_type):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.client.put_object(
+                    self.bucket_name,
+                    object_name,
+                    io.BytesIO(image_bytes),
+                    len(image_bytes),
+                    content_type=content_type,
+                    part_size=self.part_size
+                )
+                self._count("uploaded")
+                return True
+            except Exception as e:
+                permanent = isinstance(e, S3Error) and e.code in PERMANENT_S3_ERRORS
+                if permanent or attempt == self.max_retries:
+                    self._count("failed")
+                    print(f"❌ [MINIO ERROR] Upload thất bại ({object_name}): {e}")
+                    return False
+                self._count("retries")
+                time.sleep(self.backoff * (2 ** attempt))
+        return False
+
+    def close(self, timeout=30):
+        """Ngừng nhận ảnh mới và upload hết những ảnh còn trong hàng đợi"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+        print(f"[MINIO] Đã đóng uploader | Đã upload: {self.stats['uploaded']} | Lỗi: {self.stats['failed']} | Bỏ: {self.stats['dropped']}")
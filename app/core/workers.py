@@ -0,0 +1,205 @@
+import itertools
+import threading
+import queue
+import multiprocessing as mp
+from concurrent.futures import Future, TimeoutError
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np #type: ignore
+from app.core.backends import create_backend, cpu_thread_count, warmup_backend
+
+
+def _worker_main(worker_id, backend, model_path, device, backend_options, task_queue, result_queue):
+    """Vòng lặp của 1 process inference: đọc ảnh từ shared memory, chạy model, trả detections"""
+    try:
+        model = create_backend(backend, model_path, device=device, **backend_options)
+        # Warm-up ngay trong từng worker, trước khi báo sẵn sàng
+        warmup_backend(model)
+    except Exception as e:
+        result_queue.put(("ready", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+    result_queue.put(("ready", worker_id, getattr(model, "names", None), None))
+
+    attached = {} # Các slot dùng lại nhiều lần: mở 1 lần rồi giữ luôn
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, shm_name, pooled, layout, params = task
+        try:
+            shm = attached.get(shm_name) or SharedMemory(name=shm_name)
+            # View thẳng vào shared memory, không copy ảnh
+            images = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset) for offset, shape in layout]
+            outputs = model.predict(images, **params)
+            del images
+            if pooled:
+                attached[shm_name] = shm
+            else:
+                shm.close()
+            result_queue.put(("result", task_id, outputs, None))
+        except Exception as e:
+            result_queue.put(("result", task_id, None, f"{type(e).__name__}: {e}"))
+
+    for shm in attached.values():
+        shm.close()
+
+
+class _SlotPool:
+    """Các vùng shared memory cấp sẵn, dùng lại giữa các request. Ảnh quá lớn thì cấp vùng tạm riêng."""
+    def __init__(self, num_slots, slot_bytes):
+        self.slot_bytes = int(slot_bytes)
+        self.slots = [SharedMemory(create=True, size=self.slot_bytes) for _ in range(num_slots)]
+        self._free = queue.Queue()
+        for i in range(num_slots):
+            self._free.put(i)
+
+    def acquire(self, nbytes):
+        """Trả về (shm, slot_index). slot_index = None nghĩa là vùng tạm, phải unlink sau khi dùng."""
+        if nbytes <= self.slot_bytes:
+            index = self._free.get()
+            return self.slots[index], index
+        return SharedMemory(create=True, size=max(1, nbytes)), None
+
+    def release(self, shm, index):
+        if index is None:
+            shm.close()
+            shm.unlink()
+        else:
+            self._free.put(index)
+
+    def retire(self, shm, index):
+        """
+        Bỏ hẳn vùng nhớ mà worker có thể vẫn đang đọc (VD: request bị timeout) thay vì trả lại pool,
+        để request sau không ghi đè lên ảnh worker đang xử lý. Slot được thay bằng vùng mới cùng kích thước.
+        """
+        shm.close()
+        shm.unlink() # Worker đã map vùng nhớ vẫn đọc được tới khi tự đóng
+        if index is not None:
+            self.slots[index] = SharedMemory(create=True, size=self.slot_bytes)
+            self._free.put(index)
+
+    def close(self):
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+
+
+class InferencePool:
+    """
+    Pool các process inference, mỗi process giữ 1 bản model. Front end HTTP chỉ giữ 1 bộ
+    Mongo/MinIO client; ảnh đã decode được chuyển sang worker qua shared memory thay vì pickle bytes.
+
+    Dùng như 1 backend bình thường (có predict/names), truyền vào ImageFilter qua tham số backend.
+    - num_workers: số process (mặc định = số core / threads_per_worker)
+    - threads_per_worker: số thread ONNX Runtime mỗi process khi chạy CPU
+    - slot_bytes: kích thước mỗi slot shared memory (1 batch ảnh phải vừa 1 slot, không thì cấp vùng tạm)
+    """
+    def __init__(self, backend, model_path, device="cpu", backend_options=None, num_workers=None, threads_per_worker=None, slot_bytes=16 * 1024 * 1024, num_slots=None, timeout=120):
+        backend_options = dict(backend_options or {})
+        cores = cpu_thread_count()
+        if str(device).lower() == "cpu":
+            num_workers = num_workers or max(1, cores // (threads_per_worker or 2))
+            # Chia đều core cho các worker để các session ONNX Runtime không tranh thread
+            backend_options.setdefault("threads", threads_per_worker or max(1, cores // num_workers))
+        else:
+            num_workers = num_workers or 1
+        self.num_workers = int(num_workers)
+        self.timeout = timeout
+        self.names = None
+
+        ctx = mp.get_context("spawn") # spawn an toàn với CUDA và thread đang chạy ở process cha
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._slots = _SlotPool(num_slots or self.num_workers * 2, slot_bytes)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+        print(f"[INFO] Đang khởi động {self.num_workers} process inference ({backend}, {device})...")
+        self._processes = []
+        for i in range(self.num_workers):
+            process = ctx.Process(
+                target=_worker_main,
+                args=(i, backend, model_path, device, backend_options, self._tasks, self._results),
+                name=f"inference-worker-{i}",
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        self._wait_ready()
+
+        self._dispatcher = threading.Thread(target=self._dispatch, name="inference-pool-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _wait_ready(self):
+        try:
+            for _ in range(self.num_workers):
+                kind, worker_id, names, error = self._results.get(timeout=self.timeout)
+                if error:
+                    raise RuntimeError(f"Worker {worker_id} không load được model: {error}")
+                self.names = self.names or names
+        except queue.Empty:
+            # Dọn process + shared memory trước khi báo lỗi, để các lần init lại không rò rỉ
+            self.close()
+            raise RuntimeError(f"Worker inference chưa sẵn sàng sau {self.timeout}s") from None
+        except Exception:
+            self.close()
+            raise
+        print(f"[INFO] ✅ {self.num_workers} process inference đã sẵn sàng")
+
+    def _dispatch(self):
+        """Luồng nền nhận kết quả từ các worker và trả về đúng Future đang chờ"""
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            _, task_id, outputs, error = message
+            with self._lock:
+                future = self._pending.pop(task_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(RuntimeError(f"Lỗi inference ở worker: {error}"))
+            else:
+                future.set_result(outputs)
+
+    def predict(self, images, **params):
+        images = [np.ascontiguousarray(img, dtype=np.uint8) for img in images]
+        if not images:
+            return []
+        shm, slot = self._slots.acquire(sum(img.nbytes for img in images))
+        timed_out = False
+        try:
+            # Chép ảnh đã decode vào shared memory (1 lần memcpy / ảnh), gửi cho worker chỉ vị trí + shape
+            layout, offset = [], 0
+            for img in images:
+                np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = img
+                layout.append((offset, img.shape))
+                offset += img.nbytes
+
+            task_id = next(self._ids)
+            future = Future()
+            with self._lock:
+                self._pending[task_id] = future
+            self._tasks.put((task_id, shm.name, slot is not None, layout, params))
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                timed_out = True
+                with self._lock:
+                    self._pending.pop(task_id, None)
+                raise
+        finally:
+            if timed_out:
+                self._slots.retire(shm, slot)
+            else:
+                self._slots.release(shm, slot)
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._slots.close()
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import concurrent.futures
+
+# Engine asyncio cho batch_test: tải ảnh -> gọi API -> ghi kết quả chạy thành 3 stage nối bằng hàng đợi giới hạn,
+# số request đang bay do AIMDLimiter điều chỉnh theo latency / lỗi quá tải của server.
+
+RETRYABLE_STATUS = (429, 502, 503, 504)
+
+
+class AIMDLimiter:
+    """
+    Giới hạn số request đang bay kiểu AIMD (như TCP congestion control):
+    - Thành công, latency ổn định: tăng cộng increase mỗi ~limit request (≈ +increase mỗi vòng)
+    - 429/5xx/timeout hoặc latency ngắn hạn > latency_tolerance × latency nền: nhân limit với decrease
+      (tối đa 1 lần mỗi cooldown giây để 1 đợt lỗi không đánh sập limit về min)
+
+    Latency ngắn hạn là EWMA (short_alpha) của latency. Latency nền là trung bình min_samples mẫu đầu tiên
+    (lúc concurrency còn thấp), sau đó chỉ trôi rất chậm (baseline_alpha) theo các mẫu không quá tải.
+    Dùng trung bình thay vì latency nhỏ nhất nên tập ảnh lẫn ảnh nhỏ (nhanh) và ảnh 12MP (chậm) không bị coi
+    là quá tải, còn latency tăng dần do server xếp hàng không kéo nền lên theo.
+    target_latency (giây) cố định ngưỡng nếu muốn. Tạo trong event loop đang chạy.
+    """
+    def __init__(self, initial=4, min_limit=1, max_limit=64, increase=1.0, decrease=0.5, latency_tolerance=2.0, target_latency=None, cooldown=1.0,
+                 short_alpha=0.1, baseline_alpha=0.001, min_samples=50):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.short_alpha = short_alpha
+        self.baseline_alpha = baseline_alpha
+        self.min_samples = min_samples
+        self.stats = {"increases": 0, "decreases": 0, "peak_limit": self.limit, "baseline_latency": None}
+        self._in_flight = 0
+        self._samples = 0
+        self._short = None
+        self._baseline = 0.0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+
+    async def release(self, latency=None, overloaded=False):
+        """latency=None và overloaded=False: trả slot mà không điều chỉnh limit (VD: ảnh tải lỗi)"""
+        async with self._cond:
+            self._in_flight -= 1
+            if overloaded or latency is not None:
+                self._adjust(latency, overloaded)
+            self._cond.notify_all()
+
+    def _adjust(self, latency, overloaded):
+        congested = overloaded
+        if latency is not None and not overloaded:
+            self._samples += 1
+            self._short = latency if self._short is None else self._short + self.short_alpha * (latency - self._short)
+            if self.target_latency:
+                congested = self._short > self.target_latency
+            elif self._samples <= self.min_samples:
+                self._baseline += (latency - self._baseline) / self._samples
+            else:
+                congested = self._short > self._baseline * self.latency_tolerance
+                if not congested:
+                    self._baseline += self.baseline_alpha * (latency - self._baseline)
+            self.stats["baseline_latency"] = round(self._baseline, 4)
+
+        now = time.monotonic()
+        if congested:
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = now
+                self.stats["decreases"] += 1
+        elif self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self.stats["increases"] += 1
+            self.stats["peak_limit"] = max(self.stats["peak_limit"], self.limit)
+
+
+class Checkpoint:
+    """
+    File JSONL local ghi mỗi ảnh đã có kết quả ({"filename", "status"}), để chạy lại bỏ qua ảnh đã Done
+    mà không phụ thuộc việc ghi Mongo. Ảnh lỗi không được coi là xong nên sẽ chạy lại.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Dòng cuối có thể bị cắt dở nếu lần trước bị ngắt giữa chừng
+                    if entry.get("status") == "Done":
+                        self.done.add(entry["filename"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, task, status):
+        self._file.write(json.dumps({"filename": task["filename"], "actual_label": task["actual_label"], "status": status}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if status == "Done":
+            self.done.add(task["filename"])
+
+    def close(self):
+        self._file.close()
+
+
+async def run_pipeline(source, tasks, api_url, on_result, api_key=None, form_data=None, checkpoint=None, progress=None,
+                       download_workers=8, queue_size=64, limiter_config=None, timeout=60, max_retries=3, http2=False):
+    """
+    Chạy toàn bộ tasks qua 3 stage:
+    1. download: download_workers luồng gọi source.read, đẩy ảnh vào hàng đợi (tối đa queue_size ảnh chờ)
+    2. api: gửi ảnh lên API qua 1 httpx.AsyncClient, số request đang bay do AIMDLimiter quyết định;
+       429/5xx/timeout được thử lại tối đa max_retries lần (tôn trọng Retry-After)
+    3. write: gọi on_result(task, outcome) (hàm đồng bộ, chạy ở thread pool) rồi ghi checkpoint
+
+    outcome = {"status_code", "json", "error", "latency"}; on_result trả về status của record.
+    Trả về dict thống kê của lần chạy.
+    """
+    import httpx # type:ignore
+
+    loop = asyncio.get_running_loop()
+    limiter = AIMDLimiter(**(limiter_config or {}))
+    downloaded = asyncio.Queue(maxsize=queue_size)
+    results = asyncio.Queue(maxsize=queue_size)
+    pending = iter(tasks)
+    read_pool = concurrent.futures.ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="batch-read")
+    write_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-write")
+    stats = {"done": 0, "failed": 0, "retries": 0}
+    started = time.perf_counter()
+
+    async def download_worker():
+        while True:
+            # Event loop đơn luồng nên lấy task kế tiếp không cần lock
+            task = next(pending, None)
+            if task is None:
+                return
+            try:
+                data = await loop.run_in_executor(read_pool, source.read, task)
+            except Exception as e:
+                print(f"  [LỖI] Không đọc được {task['filename']}: {e}")
+                data = None
+            await downloaded.put((task, data))
+
+    async def download_stage():
+        await asyncio.gather(*(download_worker() for _ in range(download_workers)))
+        await downloaded.put(None)
+
+    async def call_api(client, task, data):
+        outcome = {"status_code": None, "json": None, "error": None, "latency": None}
+        if data is None:
+            await limiter.release()
+            outcome["error"] = "Download Failed"
+            await results.put((task, outcome))
+            return
+
+        attempt = 0
+        while True:
+            sent = time.perf_counter()
+            retry_after = None
+            try:
+                resp = await client.post(api_url, files={"file": (task["filename"], data, "image/jpeg")}, data=form_data or {})
+                latency = time.perf_counter() - sent
+                overloaded = resp.status_code in RETRYABLE_STATUS
+                outcome.update(status_code=resp.status_code, latency=round(latency, 4), error=None)
+                if resp.status_code == 200:
+                    outcome["json"] = resp.json()
+                retry_after = resp.headers.get("retry-after")
+                await limiter.release(None if overloaded else latency, overloaded)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                overloaded = True
+                outcome.update(status_code=None, error=f"{type(e).__name__}: {e}")
+                await limiter.release(None, True)
+            except Exception as e:
+                overloaded = False
+                outcome.update(status_code=None, error=f"{type(e).__name__}: {e}")
+                await limiter.release()
+
+            if not overloaded or attempt >= max_retries:
+                break
+            attempt += 1
+            stats["retries"] += 1
+            try:
+                delay = float(retry_after) if retry_after else min(10.0, 0.5 * 2 ** attempt)
+            except ValueError:
+                delay = min(10.0, 0.5 * 2 ** attempt)
+            await asyncio.sleep(delay)
+            await limiter.acquire()
+        await results.put((task, outcome))
+
+    async def api_stage(client):
+        running = set()
+        while True:
+            item = await downloaded.get()
+            if item is None:
+                break
+            await limiter.acquire()
+            job = asyncio.ensure_future(call_api(client, *item))
+            running.add(job)
+            job.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running)
+        await results.put(None)
+
+    async def write_stage():
+        while True:
+            item = await results.get()
+            if item is None:
+                return
+            task, outcome = item
+            try:
+                status = await loop.run_in_executor(write_pool, on_result, task, outcome)
+            except Exception as e:
+                print(f"  [LỖI] Không ghi được kết quả {task['filename']}: {e}")
+                status = f"Write Error: {e}"
+            stats["done" if status == "Done" else "failed"] += 1
+            if checkpoint:
+                checkpoint.add(task, status)
+            if progress:
+                progress.update(1)
+                progress.set_postfix(limit=int(limiter.limit), in_flight=limiter.in_flight)
+
+    limits = httpx.Limits(max_connections=limiter.max_limit, max_keepalive_connections=limiter.max_limit)
+    headers = {"x-api-key": api_key} if api_key else {}
+    try:
+        async with httpx.AsyncClient(http2=http2, timeout=timeout, limits=limits, headers=headers) as client:
+            await asyncio.gather(download_stage(), api_stage(client), write_stage())
+    finally:
+        read_pool.shutdown(wait=False)
+        write_pool.shutdown(wait=True)
+
+    elapsed = time.perf_counter() - started
+    stats.update(limiter.stats)
+    stats.update({
+        "elapsed_s": round(elapsed, 2),
+        "images_per_s": round((stats["done"] + stats["failed"]) / elapsed, 2) if elapsed else 0.0,
+        "final_limit": round(limiter.limit, 2),
+    })
+    return stats
@@ -1,7 +1,8 @@
 import os
 import sys
-import io
+import argparse
 import requests # type:ignore
+from requests.adapters import HTTPAdapter # type:ignore
 import pandas as pd # type:ignore
 import time
 import random
@@ -9,17 +10,16 @@ from datetime import datetime
 from tqdm import tqdm # type:ignore
 from pymongo import MongoClient # type:ignore
 from dotenv import load_dotenv # type:ignore
-from google.auth.transport.requests import Request # type:ignore
-from google.oauth2.credentials import Credentials # type:ignore
-from google_auth_oauthlib.flow import InstalledAppFlow # type:ignore
-from googleapiclient.discovery import build # type:ignore
-from googleapiclient.http import MediaIoBaseDownload # type:ignore
 import concurrent.futures
-from threading import Lock
+from threading import Lock, BoundedSemaphore
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 if project_root not in sys.path:
     sys.path.append(project_root)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+from app.core.log_writer import MongoLogWriter, ensure_log_indexes # noqa: E402
+from task_sources import LocalFolderSource, ArchiveSource, MinioPrefixSource, DriveSource, prefetch # noqa: E402
 CREDENTIALS_DIR = os.path.join(project_root, "credentials")
 TOKEN_FILE = os.path.join(CREDENTIALS_DIR, 'token.json')
 CLIENT_SECRETS_FILE = os.path.join(CREDENTIALS_DIR, 'client_secrets.json')
@@ -30,12 +30,17 @@ API_KEY = os.getenv("API_KEY")
 DRIVE_BASE_FOLDER_NAME = "DATA"
 DRIVE_SUB_FOLDER_NAME = "object_detection"
 DRIVE_VPP_FOLDER_NAME = "classes-do-gia-dung"
+DRIVE_ROOT_FOLDER_ID = "1PlH4I4MMHal4oMFf6aqFnUC8-sOwO60A"
+DRIVE_LISTING_CACHE = os.path.join(CREDENTIALS_DIR, "drive_listing_cache.json")
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = "api_request_log" 
 COLLECTION_NAME = "test_confidence_0.1"
 CONFIG_COLLECTION = "system_config"
+# source của record kết quả do batch_test ghi (log của server dùng source "batch_test" gửi lên API)
+RESULT_SOURCE = "batch_client_result"
+# Số luồng gọi API song song (ghi đè bằng --workers)
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "5"))
 
-drive_lock = Lock()
 print_lock = Lock()
 # 1. Nhóm Model Đã Học Tốt (STRONG)
 # Gồm các class có > 170 mẫu
@@ -61,8 +66,27 @@ RATIOS = {
     "WEAK": 0.4    # Lấy 30% từ nhóm Sofa, Toaster...
     # "UNKNOWN": 0.2  # Lấy 20% từ nhóm Quạt, Chổi (để test lọc nhiễu)
 }
+_mongo_client = None
+_mongo_lock = Lock()
+
+
 def get_mongo_client():
-    return MongoClient(MONGO_URI)
+    """1 MongoClient dùng chung cho cả tiến trình (MongoClient thread-safe và tự có connection pool)"""
+    global _mongo_client
+    with _mongo_lock:
+        if _mongo_client is None:
+            _mongo_client = MongoClient(MONGO_URI, maxPoolSize=max(10, MAX_WORKERS * 2))
+        return _mongo_client
+
+
+def get_http_session(pool_size):
+    """Session dùng chung giữa các luồng: giữ kết nối keep-alive thay vì bắt tay TCP/TLS lại cho từng ảnh"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"x-api-key": API_KEY or ""})
+    return session
 def get_active_api_url():
     """
     Hàm mới: Tự động lấy URL Cloudflare mới nhất từ MongoDB.
@@ -85,7 +109,12 @@ def get_active_api_url():
     except Exception as e:
         print(f"⚠️ Lỗi lấy URL từ Mongo: {e}. Dùng Localhost.")
         return "http://127.0.0.1:8000/v1/filter"
-def get_drive_service():
+def get_drive_credentials():
+    """Đọc token.json, refresh hoặc chạy OAuth flow nếu cần (chỉ gọi 1 lần cho cả tiến trình)"""
+    # Chỉ cần thư viện Google khi chạy với --source drive
+    from google.auth.transport.requests import Request # type:ignore
+    from google.oauth2.credentials import Credentials # type:ignore
+    from google_auth_oauthlib.flow import InstalledAppFlow # type:ignore
     creds = None
     if os.path.exists(TOKEN_FILE):
         creds = Credentials.from_authorized_user_file(TOKEN_FILE, ["https://www.googleapis.com/auth/drive"])
@@ -97,207 +126,146 @@ def get_drive_service():
             creds = flow.run_local_server(port=0)
         with open(TOKEN_FILE, 'w') as token:
             token.write(creds.to_json())
-    return build('drive', 'v3', credentials=creds)
+    return creds
 
-def list_all_files_in_folder(service, folder_id):
-    all_files = []
-    page_token = None
-    while True:
-        try:
-            response = service.files().list(q=f"'{folder_id}' in parents and trashed=false",
-                fields='nextPageToken, files(id, name)', pageSize=1000, pageToken=page_token).execute()
-            all_files.extend(response.get('files', []))
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-        except Exception as e:
-            print(f"  [LỖI] Lỗi khi liệt kê file (pagination): {e}")
-            break
-    print(f"  Đã tìm thấy tổng cộng {len(all_files)} files (ảnh + metadata).")
-    return all_files
-
-def find_folder_id_by_name(service, folder_name, parent_id):
-    """Tìm ID của folder con dựa vào tên và ID cha"""
-    try:
-        query = f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' and '{parent_id}' in parents and trashed = false"
-        results = service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get('files', [])
-        if not files:
-            print(f"❌ [LỖI] Không tìm thấy folder '{folder_name}' trong parent '{parent_id}'")
-            return None
-        return files[0]['id']
-    except Exception as e:
-        print(f"❌ [LỖI API] Khi tìm folder {folder_name}: {e}")
-        return None
-def download_file_bytes(service, file_id):
-    """Tải file về RAM dưới dạng bytes"""
-    try:
-        with drive_lock:
-            request = service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            fh.seek(0)
-            return fh.getvalue() # Trả về bytes
-    except Exception:
-        return None
-
-def build_task_list(service):
-    tasks = []
-    print("🔄 Đang định vị thư mục mục tiêu...")
-
-    data_id = find_folder_id_by_name(service, DRIVE_BASE_FOLDER_NAME, "1PlH4I4MMHal4oMFf6aqFnUC8-sOwO60A")
-    if not data_id: 
-        return []
-
-    obj_det_id = find_folder_id_by_name(service, DRIVE_SUB_FOLDER_NAME, data_id)
-    if not obj_det_id: 
-        return []
+def build_drive_service(creds):
+    from googleapiclient.discovery import build # type:ignore
+    return build('drive', 'v3', credentials=creds)
 
-    target_root_id = find_folder_id_by_name(service, DRIVE_VPP_FOLDER_NAME, obj_det_id)
-    if not target_root_id: 
-        return []
+def get_drive_service():
+    return build_drive_service(get_drive_credentials())
 
-    print(f"✅ Đã vào tới folder đích: {DRIVE_VPP_FOLDER_NAME} (ID: {target_root_id})")
-    print("🔄 Đang quét các class con...")
-
-    class_folders = []
-    page_token = None
-    while True:
-        res = service.files().list(
-            q=f"'{target_root_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-            fields="nextPageToken, files(id, name)",
-            pageToken=page_token
-        ).execute()
-        class_folders.extend(res.get('files', []))
-        page_token = res.get('nextPageToken')
-        if not page_token: break
-
-    print(f"📂 Tìm thấy {len(class_folders)} class (nhãn). Đang quét ảnh...")
-
-    for folder in class_folders:
-        label_name = folder['name'] # Tên folder chính là nhãn thực tế (Actual Label)
-        folder_id = folder['id']
-        
-        # Lấy danh sách file ảnh trong folder class này
-        all_files = list_all_files_in_folder(service, folder_id)
-        
-        count = 0
-        for f in all_files:
-            if f['name'].lower().endswith(('.png', '.jpg', '.jpeg')):
-                tasks.append({
-                    "file_id": f['id'],
-                    "filename": f['name'],
-                    "actual_label": label_name,    
-                    "category_type": DRIVE_VPP_FOLDER_NAME
-                })
-                count += 1
-
-    return tasks
-def get_processed_filenames(collection):
-    """Lấy danh sách các filename đã có status='Done' trong DB"""
+def create_source(args):
+    """Tạo nguồn ảnh theo --source"""
+    if args.source == "folder":
+        return LocalFolderSource(args.path)
+    if args.source == "archive":
+        return ArchiveSource(args.path)
+    if args.source == "minio":
+        from minio import Minio # type:ignore
+        client = Minio(
+            os.getenv("MINIO_ENDPOINT"),
+            access_key=os.getenv("MINIO_ACCESS_KEY"),
+            secret_key=os.getenv("MINIO_SECRET_KEY"),
+            secure=os.getenv("MINIO_SECURE", "False").lower() == "true",
+        )
+        bucket, _, prefix = args.path.partition("/")
+        return MinioPrefixSource(client, bucket, prefix)
+    return DriveSource(
+        get_drive_credentials,
+        build_drive_service,
+        DRIVE_ROOT_FOLDER_ID,
+        [DRIVE_BASE_FOLDER_NAME, DRIVE_SUB_FOLDER_NAME, DRIVE_VPP_FOLDER_NAME],
+        cache_path=DRIVE_LISTING_CACHE,
+        cache_ttl=0 if args.refresh_listing else 24 * 3600,
+    )
+def get_processed_filenames(collection, filenames, chunk_size=1000):
+    """
+    Trong các filename của lần chạy này, lấy những file đã có kết quả status='Done' trong DB.
+    Tra từng chunk bằng $in trên chỉ mục source/status/filename thay vì quét toàn bộ kết quả cũ.
+    """
     print("🔍 Đang kiểm tra lịch sử trong MongoDB...")
-    query = {
-        "source": "batch_test",
-        "status": "Done"
-    }
-    # Chỉ lấy trường filename để tiết kiệm RAM
-    records = collection.find(query, {"filename": 1})
-    processed_set = set(doc['filename'] for doc in records)
+    filenames = list(set(filenames))
+    processed_set = set()
+    for start in range(0, len(filenames), chunk_size):
+        query = {
+            "source": RESULT_SOURCE,
+            "status": "Done",
+            "filename": {"$in": filenames[start:start + chunk_size]}
+        }
+        # Chỉ lấy trường filename (nằm sẵn trong chỉ mục, không phải đọc document)
+        records = collection.find(query, {"filename": 1, "_id": 0})
+        processed_set.update(doc['filename'] for doc in records)
     print(f"📚 Tìm thấy {len(processed_set)} ảnh đã xử lý xong trước đó.")
     return processed_set
-def process_single_task(task, api_url, service):
-    """Hàm này chạy song song trên mỗi luồng"""
-    filename = task['filename']
-    actual = task['actual_label']
-    
-    # Tạo Client Mongo riêng cho luồng này (Thread-safe)
-    local_client = MongoClient(MONGO_URI)
-    local_collection = local_client[DB_NAME][COLLECTION_NAME]
-
-    result_record = {
+def new_result_record(task):
+    """Record kết quả ban đầu của 1 ảnh (status cập nhật sau khi gọi API)"""
+    return {
         "timestamp": datetime.now(),
-        "filename": filename,
-        "actual_label": actual,
+        "filename": task['filename'],
+        "actual_label": task['actual_label'],
         "type": task['category_type'],
         "group_type": task.get('group_type', 'FULL_DATASET'),
         # "group_type": "FULL_DATASET",
         "status": "Processing",
-        "source": "batch_client_result"
+        "source": RESULT_SOURCE
+    }
+def evaluate_response(task, res_json):
+    """So kết quả API với nhãn thực tế, trả về các trường cần cập nhật vào record"""
+    actual = task['actual_label']
+    detected_labels = res_json.get("detected_labels", [])
+    action = res_json.get("action", "UNKNOWN")
+    detections = res_json.get("detections", [])
+
+    bboxes = []
+    all_confs = []
+    target_confs = []
+    actual_norm = str(actual).lower().strip()
+    if detections:
+        for d in detections:
+            conf = d.get('confidence', 0)
+            label = str(d.get('object', '')).lower()
+
+            # Lưu box
+            if 'box' in d: 
+                bboxes.append(str(d['box']))
+
+            all_confs.append(conf)
+
+            # Kiểm tra xem object này có khớp với Actual Label không?
+            # Ví dụ: actual="table" khớp với label="dining table"
+            if actual_norm in label:
+                target_confs.append(conf)
+    if target_confs:
+        # Model CÓ nhìn thấy vật thể đúng
+        # Lấy max của đúng vật thể đó (VD: Lấy 0.15 của Table, bỏ qua 0.95 của Person)
+        final_conf = max(target_confs)
+    elif all_confs:
+        # Model KHÔNG thấy vật thể đúng
+        # Lấy max của vật thể gây nhiễu nhất (để biết model đang nhìn nhầm ra cái gì mạnh nhất)
+        final_conf = max(all_confs) 
+    else:
+        final_conf = 0.0
+
+    bbox_str = " | ".join(bboxes) if bboxes else ""
+    pred_str = ", ".join(detected_labels) if detected_labels else "None"
+
+    is_correct = False
+    if task['category_type'].lower() == "unknown":
+        is_correct = (not detected_labels) or (action == "UNPROCESSED")
+    else:
+        actual_norm = str(actual).lower().strip()
+        for lbl in detected_labels:
+            if actual_norm in str(lbl).lower():
+                is_correct = True
+                break
+
+    return {
+        "predicted_label": pred_str,
+        "confidence": final_conf,
+        "bounding_box": bbox_str,
+        "action": action,
+        "is_correct": is_correct,
+        "detected_labels": detected_labels,
+        "status": "Done"
     }
+def process_single_task(task, api_url, img_bytes, session, result_writer):
+    """
+    Hàm này chạy song song trên mỗi luồng (ảnh đã được prefetch sẵn).
+    Dùng chung session HTTP và đẩy kết quả vào result_writer để ghi Mongo theo lô.
+    """
+    result_record = new_result_record(task)
 
     try:
-        # Tải ảnh
-        img_bytes = download_file_bytes(service, task['file_id'])
-        
         if img_bytes:
             # Gọi API (Phần này chạy song song, không cần Lock)
-            files = {"file": (filename, img_bytes, 'image/jpeg')}
+            files = {"file": (task['filename'], img_bytes, 'image/jpeg')}
             data = {"source": "batch_test"}
-            headers = {"x-api-key": API_KEY}
             
-            resp = requests.post(api_url, files=files, data=data, headers=headers, timeout=60)
+            resp = session.post(api_url, files=files, data=data, timeout=60)
             
             if resp.status_code == 200:
-                res_json = resp.json()
-                detected_labels = res_json.get("detected_labels", [])
-                action = res_json.get("action", "UNKNOWN")
-                detections = res_json.get("detections", [])
-                
-                bboxes = []
-                all_confs = []
-                target_confs = []
-                actual_norm = str(actual).lower().strip()
-                if detections:
-                    for d in detections:
-                        conf = d.get('confidence', 0)
-                        label = str(d.get('object', '')).lower()
-                        
-                        # Lưu box
-                        if 'box' in d: 
-                            bboxes.append(str(d['box']))
-                        
-                        all_confs.append(conf)
-
-                        # Kiểm tra xem object này có khớp với Actual Label không?
-                        # Ví dụ: actual="table" khớp với label="dining table"
-                        if actual_norm in label:
-                            target_confs.append(conf)
-                if target_confs:
-                    # Model CÓ nhìn thấy vật thể đúng
-                    # Lấy max của đúng vật thể đó (VD: Lấy 0.15 của Table, bỏ qua 0.95 của Person)
-                    final_conf = max(target_confs)
-                elif all_confs:
-                    # Model KHÔNG thấy vật thể đúng
-                    # Lấy max của vật thể gây nhiễu nhất (để biết model đang nhìn nhầm ra cái gì mạnh nhất)
-                    final_conf = max(all_confs) 
-                else:
-                    final_conf = 0.0
-        
-                bbox_str = " | ".join(bboxes) if bboxes else ""
-                pred_str = ", ".join(detected_labels) if detected_labels else "None"
-                
-                is_correct = False
-                if task['category_type'].lower() == "unknown":
-                    is_correct = (not detected_labels) or (action == "UNPROCESSED")
-                else:
-                    actual_norm = str(actual).lower().strip()
-                    for lbl in detected_labels:
-                        if actual_norm in str(lbl).lower():
-                            is_correct = True
-                            break
-                
-                result_record.update({
-                    "predicted_label": pred_str,
-                    "confidence": final_conf,
-                    "bounding_box": bbox_str,
-                    "action": action,
-                    "is_correct": is_correct,
-                    "detected_labels": detected_labels,
-                    "status": "Done"
-                })
+                result_record.update(evaluate_response(task, resp.json()))
             else:
                 result_record["status"] = f"API Error {resp.status_code}"
         else:
@@ -307,9 +275,8 @@ def process_single_task(task, api_url, service):
         result_record["status"] = f"Code Error: {str(e)}"
     
     finally:
-        # Ghi vào DB và đóng kết nối
-        local_collection.insert_one(result_record)
-        local_client.close()
+        # Ghi vào DB theo lô ở luồng nền
+        result_writer.submit(result_record)
 def filter_and_sample_tasks(all_tasks, processed_files):
     print("\n⚖️  Đang lấy mẫu dữ liệu...")
     
@@ -369,23 +336,29 @@ def filter_and_sample_tasks(all_tasks, processed_files):
     
     print(f"🚀 TỔNG CỘNG: Đã chọn được {len(final_tasks)} ảnh để chạy test.")
     return final_tasks
-def run_test():
-    print("🚀 Bắt đầu Test (Multi-thread)...")
+def run_test(args):
+    print(f"🚀 Bắt đầu Test ({'Asyncio' if args.engine == 'async' else 'Multi-thread'})...")
     
     api_url = get_active_api_url()
     
-    # Init Service (1 lần duy nhất)
-    service = get_drive_service()
-    if not service:
-        print("❌ Không kết nối được Google Drive")
-        return
-
-    # Lấy danh sách task và lọc trùng
-    tasks = build_task_list(service)
+    # Lấy danh sách task từ nguồn ảnh và lọc trùng
+    source = create_source(args)
+    tasks = source.list_tasks()
+    print(f"📂 Nguồn '{args.source}': {len(tasks)} ảnh.")
     
-    client = get_mongo_client()
-    processed_files = get_processed_filenames(client[DB_NAME][COLLECTION_NAME])
-    client.close()
+    collection = get_mongo_client()[DB_NAME][COLLECTION_NAME]
+    try:
+        ensure_log_indexes(collection)
+    except Exception as e:
+        print(f"⚠️ Không tạo được chỉ mục MongoDB: {e}")
+    processed_files = get_processed_filenames(collection, [t['filename'] for t in tasks])
+    checkpoint = None
+    if args.engine == "async":
+        from async_engine import Checkpoint
+        # Resume: bỏ qua cả ảnh đã Done trong checkpoint local
+        checkpoint = Checkpoint(args.checkpoint)
+        print(f"📒 Checkpoint {args.checkpoint}: {len(checkpoint.done)} ảnh đã xong.")
+        processed_files = processed_files | checkpoint.done
     
     # tasks_to_run = [t for t in tasks if t['filename'] not in processed_files]
     tasks_to_run = filter_and_sample_tasks(tasks, processed_files)
@@ -394,22 +367,121 @@ def run_test():
     
     if total_tasks == 0:
         print("✅ Đã xử lý hết. Không còn gì để chạy.")
+        if checkpoint:
+            checkpoint.close()
+        return
+
+    if args.engine == "async":
+        try:
+            run_async_engine(args, source, tasks_to_run, api_url, collection, checkpoint)
+        finally:
+            checkpoint.close()
+            get_mongo_client().close()
         return
 
-    # Max Workers = 5 để không bị Google chặn rate limit
-    MAX_WORKERS = 5 
-    print(f"⚡ Đang chạy với {MAX_WORKERS} luồng song song...")
+    workers = max(1, args.workers)
+    print(f"⚡ Đang chạy với {workers} luồng song song, {args.prefetch_workers} luồng tải ảnh...")
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submit tất cả công việc vào Pool
-        futures = []
-        for task in tasks_to_run:
-            futures.append(executor.submit(process_single_task, task, api_url, service))
-        
-        # Dùng tqdm để hiện thanh loading
-        for _ in tqdm(concurrent.futures.as_completed(futures), total=total_tasks, desc="Processing Images"):
-            pass
+    # Giới hạn số ảnh đã tải nằm chờ trong pool để không đọc cả tập vào RAM
+    in_flight = BoundedSemaphore(workers * 2)
+    session = get_http_session(workers)
+    # Kết quả được gom và insert_many theo lô; chờ thay vì bỏ kết quả khi hàng đợi đầy
+    result_writer = MongoLogWriter(collection, batch_size=100, flush_interval=1.0, block_timeout=60)
+
+    # Dùng tqdm để hiện thanh loading
+    progress = tqdm(total=total_tasks, desc="Processing Images")
+
+    def run_one(task, img_bytes):
+        try:
+            process_single_task(task, api_url, img_bytes, session, result_writer)
+        finally:
+            in_flight.release()
+            progress.update(1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Ảnh được tải song song trước (prefetch), luồng gọi API không phải chờ tải từng ảnh
+        for task, img_bytes in prefetch(source, tasks_to_run, workers=args.prefetch_workers, depth=args.prefetch_depth):
+            in_flight.acquire()
+            executor.submit(run_one, task, img_bytes)
+    progress.close()
+    result_writer.close()
+    session.close()
+    get_mongo_client().close()
 
     print("\n✅ Đã hoàn thành test đa luồng.")
+
+
+def run_async_engine(args, source, tasks_to_run, api_url, collection, checkpoint):
+    """Chạy bằng engine asyncio: tải / gọi API / ghi kết quả là 3 stage, concurrency tự điều chỉnh (AIMD)"""
+    import asyncio
+    from async_engine import run_pipeline
+
+    result_writer = MongoLogWriter(collection, batch_size=100, flush_interval=1.0, block_timeout=60)
+
+    def on_result(task, outcome):
+        result_record = new_result_record(task)
+        if outcome["status_code"] == 200:
+            try:
+                result_record.update(evaluate_response(task, outcome["json"]))
+            except Exception as e:
+                result_record["status"] = f"Code Error: {str(e)}"
+        elif outcome["status_code"] is not None:
+            result_record["status"] = f"API Error {outcome['status_code']}"
+        elif outcome["error"] == "Download Failed":
+            result_record["status"] = "Download Failed"
+        else:
+            result_record["status"] = f"Code Error: {outcome['error']}"
+        result_record["latency"] = outcome["latency"]
+        result_writer.submit(result_record)
+        return result_record["status"]
+
+    limiter_config = {
+        "initial": max(1, args.workers),
+        "max_limit": max(args.workers, args.max_concurrency),
+        "target_latency": args.target_latency,
+    }
+    print(f"⚡ Engine asyncio: concurrency ban đầu {limiter_config['initial']}, tối đa {limiter_config['max_limit']}, {args.prefetch_workers} luồng tải ảnh...")
+    progress = tqdm(total=len(tasks_to_run), desc="Processing Images")
+    try:
+        stats = asyncio.run(run_pipeline(
+            source, tasks_to_run, api_url, on_result,
+            api_key=API_KEY,
+            form_data={"source": "batch_test"},
+            checkpoint=checkpoint,
+            progress=progress,
+            download_workers=args.prefetch_workers,
+            queue_size=args.prefetch_depth,
+            limiter_config=limiter_config,
+            http2=args.http2,
+        ))
+    finally:
+        progress.close()
+        result_writer.close()
+
+    print(f"\n✅ Đã hoàn thành: {stats['done']} Done | {stats['failed']} lỗi | {stats['retries']} lần thử lại | "
+          f"{stats['images_per_s']} ảnh/s | concurrency cuối {stats['final_limit']} (cao nhất {round(stats['peak_limit'], 2)}, giảm {stats['decreases']} lần)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chạy test có nhãn qua API filter")
+    parser.add_argument("--source", choices=["drive", "folder", "archive", "minio"], default="drive",
+                        help="Nguồn ảnh: Google Drive, thư mục local <nhãn>/<ảnh>, file .zip/.tar(.gz) hoặc prefix MinIO")
+    parser.add_argument("--path", help="Thư mục / file archive / '<bucket>/<prefix>' tùy --source")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="threads: ThreadPoolExecutor cố định; async: pipeline asyncio + httpx, concurrency tự điều chỉnh (AIMD)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Số luồng gọi API song song / concurrency ban đầu của engine async (mặc định env MAX_WORKERS hoặc 5)")
+    parser.add_argument("--max-concurrency", type=int, default=32, help="[async] Số request đang bay tối đa")
+    parser.add_argument("--target-latency", type=float, default=None, help="[async] Latency mục tiêu (giây); mặc định tự lấy theo latency nền")
+    parser.add_argument("--checkpoint", default=os.path.join(current_dir, "batch_test_checkpoint.jsonl"), help="[async] File JSONL để resume")
+    parser.add_argument("--http2", action="store_true", help="[async] Dùng HTTP/2 (cần gói h2)")
+    parser.add_argument("--prefetch-workers", type=int, default=8, help="Số luồng tải ảnh song song")
+    parser.add_argument("--prefetch-depth", type=int, default=32, help="Số ảnh tối đa được tải trước")
+    parser.add_argument("--refresh-listing", action="store_true", help="Bỏ qua danh sách Drive đã cache, quét lại")
+    args = parser.parse_args()
+    if args.source != "drive" and not args.path:
+        parser.error(f"--source {args.source} cần --path")
+    return args
+
+
 if __name__ == "__main__":
-    run_test()
\ No newline at end of file
+    run_test(parse_args())
@@ -0,0 +1,304 @@
+"""
+Benchmark offline cho filter service: không cần Drive, Mongo, MinIO hay tunnel.
+
+Sinh (hoặc đọc) 1 bộ ảnh local rồi chạy ImageFilter.process trực tiếp (in-process) và/hoặc
+gọi /v1/filter qua HTTP (uvicorn chạy ngay trong process này) ở các mức concurrency khác nhau.
+Mongo / MinIO được thay bằng handler rỗng. Mỗi cấu hình in ra throughput, p50/p95/p99 và RSS cao nhất.
+
+Ví dụ:
+    python scripts/benchmark.py --dry                                   # backend giả lập, đo phần còn lại của pipeline
+    python scripts/benchmark.py --model models/best.onnx --backend onnxruntime --concurrency 1,4,16 --batch-sizes 1,8
+    python scripts/benchmark.py --images data/sample --target http --json result.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import types
+import socket
+import argparse
+import threading
+import contextlib
+import concurrent.futures
+import numpy as np #type: ignore
+import cv2 #type: ignore
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+TARGET_CLASSES = ["smartphone", "pen", "note paper", "t-shirt", "smartwatch", "glasses", "bracelet", "dishwasher", "cabinet", "sofa", "box cutter", "shoes", "table", "scissor", "paper"]
+
+
+class DryBackend:
+    """
+    Backend giả lập: ngủ dry_ms cho mỗi lần gọi (+ 1 phần theo số ảnh) rồi trả vài box ngẫu nhiên.
+    Các lần gọi chạy tuần tự như trên 1 thiết bị thật.
+    """
+    input_size = 640
+    names = None
+
+    def __init__(self, dry_ms=20.0, num_classes=126, seed=0):
+        self.dry_ms = dry_ms
+        self.num_classes = num_classes
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def predict(self, images, conf=0.1, iou=0.45, classes=None, max_det=300):
+        outputs = []
+        with self._lock:
+            time.sleep(self.dry_ms / 1000.0 * (0.5 + 0.5 * len(images)))
+            for img in images:
+                h, w = img.shape[:2]
+                n = int(self._rng.integers(0, 6))
+                xy = self._rng.random((n, 2)) * [w * 0.8, h * 0.8]
+                dets = np.column_stack([xy, xy + [w * 0.2, h * 0.2], self._rng.uniform(conf, 1.0, n), self._rng.integers(0, self.num_classes, n)]).astype(np.float32)
+                if classes is not None:
+                    dets = dets[np.isin(dets[:, 5], classes)]
+                outputs.append(dets[:max_det])
+        return outputs
+
+
+def generate_corpus(count, seed=0):
+    """Sinh ảnh JPEG tổng hợp (nhiều kích thước, có hình khối để không nén quá nhỏ)"""
+    rng = np.random.default_rng(seed)
+    sizes = [(480, 640), (720, 1280), (1080, 1920), (3024, 4032)]
+    corpus = []
+    for i in range(count):
+        h, w = sizes[i % len(sizes)]
+        img = np.full((h, w, 3), rng.integers(0, 255, 3), dtype=np.uint8)
+        for _ in range(12):
+            x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            cv2.rectangle(img, (x, y), (x + int(rng.integers(20, w // 3)), y + int(rng.integers(20, h // 3))), color, -1)
+        noise = rng.integers(0, 24, (h // 8, w // 8, 3), dtype=np.uint8)
+        img = cv2.add(img, cv2.resize(noise, (w, h), interpolation=cv2.INTER_NEAREST))
+        corpus.append((f"synthetic_{i:04d}_{w}x{h}.jpg", cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()))
+    return corpus
+
+
+def load_corpus(folder, limit=None):
+    corpus = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(root, name), "rb") as f:
+                    corpus.append((name, f.read()))
+                if limit and len(corpus) >= limit:
+                    return corpus
+    return corpus
+
+
+class RssSampler:
+    """Lấy mẫu RSS của process theo chu kỳ, giữ giá trị cao nhất trong lúc chạy (MB)"""
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def load_api_keys():
+    try:
+        from app.core.config import API_KEYS #type: ignore
+    except ImportError:
+        # Chưa có file key (scripts/start_dashboard.py tạo) -> dùng key tạm cho benchmark
+        config = types.ModuleType("app.core.config")
+        config.API_KEYS = {"benchmark-key": "benchmark"}
+        sys.modules["app.core.config"] = config
+        API_KEYS = config.API_KEYS
+    return API_KEYS
+
+
+def build_filter(args, batch_size):
+    from app.core.filter import ImageFilter
+    load_api_keys()
+    from app.api.main import CLASS_MAPPING
+    backend = DryBackend(args.dry_ms) if args.dry else args.backend
+    return ImageFilter(
+        model_path=args.model,
+        mongo_uri=None, db_name=None, collection_name=None,
+        target_classes=TARGET_CLASSES,
+        minio_config=None,
+        image_handler=lambda data, name: name, # Không lưu ảnh thật
+        log_handler=lambda **kwargs: None,      # Không ghi log thật
+        device=args.device,
+        class_mapping=CLASS_MAPPING,
+        batch_config={"max_batch_size": batch_size, "max_wait_ms": args.max_wait_ms} if batch_size > 1 else None,
+        cache_config=None, # Ảnh lặp lại giữa các vòng -> tắt cache để đo đúng inference
+        backend=backend,
+        reduced_decode=not args.full_decode
+    )
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def run_load(call, corpus, concurrency, total):
+    """Gọi call(filename, bytes) total lần với concurrency luồng, trả về (latencies, lỗi, thời gian)"""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        name, data = corpus[i % len(corpus)]
+        started = time.perf_counter()
+        try:
+            call(name, data)
+            ok = True
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def http_server(filter_tool):
+    """Chạy app FastAPI bằng uvicorn ở luồng nền, dùng filter đã dựng sẵn (không kết nối Mongo/MinIO)"""
+    import uvicorn #type: ignore
+    api_keys = load_api_keys()
+    import app.api.main as api
+    # Bỏ bước khởi tạo / dọn dẹp thật, gắn filter của benchmark vào (benchmark tự đóng filter)
+    api.app.router.on_startup.clear()
+    api.app.router.on_shutdown.clear()
+    api.filter_tool = filter_tool
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}/v1/filter", next(iter(api_keys))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+def benchmark(args):
+    corpus = load_corpus(args.images, args.requests) if args.images else generate_corpus(args.corpus_size)
+    if not corpus:
+        print("❌ Không có ảnh nào để chạy benchmark")
+        return []
+    print(f"📦 Corpus: {len(corpus)} ảnh, trung bình {sum(len(d) for _, d in corpus) / len(corpus) / 1024:.0f} KB")
+
+    results = []
+    for batch_size in args.batch_sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            filter_tool = build_filter(args, batch_size)
+        for target in args.targets:
+            with contextlib.ExitStack() as stack:
+                if target == "http":
+                    import requests # type:ignore
+                    url, api_key = stack.enter_context(http_server(filter_tool))
+                    session = stack.enter_context(requests.Session())
+                    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(args.concurrency)))
+
+                    def call(name, data):
+                        resp = session.post(url, files={"file": (name, data, "image/jpeg")}, data={"source": "benchmark"}, headers={"x-api-key": api_key}, timeout=120)
+                        resp.raise_for_status()
+                else:
+                    def call(name, data):
+                        filter_tool.process(data, metadata={"filename": name, "api_source": "benchmark", "user": "benchmark"})
+
+                for concurrency in args.concurrency:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        run_load(call, corpus, concurrency, min(args.warmup, len(corpus)))
+                        with RssSampler() as rss:
+                            latencies, errors, elapsed = run_load(call, corpus, concurrency, args.requests)
+                    row = {
+                        "target": target,
+                        "batch_size": batch_size,
+                        "concurrency": concurrency,
+                        "requests": args.requests,
+                        "errors": errors,
+                        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+                        "p50_ms": round(percentile(latencies, 50), 2),
+                        "p95_ms": round(percentile(latencies, 95), 2),
+                        "p99_ms": round(percentile(latencies, 99), 2),
+                        "peak_rss_mb": round(rss.peak, 1)
+                    }
+                    results.append(row)
+                    print(f"  {target:8s} batch={batch_size:<3d} conc={concurrency:<4d} {row['throughput']:8.1f} img/s | "
+                          f"p50 {row['p50_ms']:8.1f} ms | p95 {row['p95_ms']:8.1f} ms | p99 {row['p99_ms']:8.1f} ms | "
+                          f"RSS {row['peak_rss_mb']:7.1f} MB | lỗi {errors}")
+        filter_tool.close()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline cho ImageFilter và /v1/filter")
+    parser.add_argument("--images", help="Thư mục ảnh local (mặc định: tự sinh ảnh tổng hợp)")
+    parser.add_argument("--corpus-size", type=int, default=64, help="Số ảnh tổng hợp khi không có --images")
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH"), help="Đường dẫn model (bỏ qua khi dùng --dry)")
+    parser.add_argument("--backend", default=os.getenv("INFERENCE_BACKEND", "ultralytics"))
+    parser.add_argument("--device", default=os.getenv("DEVICE", "auto"))
+    parser.add_argument("--dry", action="store_true", help="Dùng backend giả lập thay vì model thật")
+    parser.add_argument("--dry-ms", type=float, default=20.0, help="Thời gian giả lập mỗi lần gọi model (ms)")
+    parser.add_argument("--target", dest="targets", default="inproc", help="inproc, http hoặc inproc,http")
+    parser.add_argument("--concurrency", default="1,4,16", help="Danh sách mức concurrency, VD: 1,4,16")
+    parser.add_argument("--batch-sizes", default="1,8", help="Danh sách max_batch_size của batcher, VD: 1,8")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--requests", type=int, default=200, help="Số request đo cho mỗi cấu hình")
+    parser.add_argument("--warmup", type=int, default=16, help="Số request chạy trước khi đo")
+    parser.add_argument("--full-decode", action="store_true", help="Tắt decode JPEG ở độ phân giải giảm")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+    args.targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    args.batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    if not args.dry and not args.model:
+        parser.error("Cần --model (hoặc MODEL_PATH) nếu không dùng --dry")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rows = benchmark(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Đã ghi kết quả vào {args.json}")
@@ -0,0 +1,241 @@
+import os
+import io
+import json
+import time
+import queue
+import zipfile
+import tarfile
+import threading
+import concurrent.futures
+
+# Nguồn ảnh cho batch_test: Google Drive, thư mục local, file tar/zip hoặc 1 prefix trên MinIO.
+# Mọi nguồn đều trả về task {"ref", "filename", "actual_label", "category_type"} (nhãn thực tế = tên thư mục class)
+# và có read(task) -> bytes an toàn khi gọi từ nhiều luồng.
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith(".")
+
+
+def _label_from_path(path):
+    """<nhãn>/<ảnh> hoặc <...>/<nhãn>/<ảnh> -> nhãn = thư mục chứa ảnh"""
+    parent = os.path.basename(os.path.dirname(path.replace("\\", "/").rstrip("/")))
+    return parent or "unknown"
+
+
+class LocalFolderSource:
+    """Thư mục local dạng <root>/<nhãn>/<ảnh>"""
+    def __init__(self, root, category_type=None):
+        self.root = os.path.abspath(root)
+        self.category_type = category_type or os.path.basename(self.root)
+
+    def list_tasks(self):
+        tasks = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in sorted(files):
+                if _is_image(name):
+                    path = os.path.join(dirpath, name)
+                    tasks.append({"ref": path, "filename": name, "actual_label": _label_from_path(path), "category_type": self.category_type})
+        return tasks
+
+    def read(self, task):
+        with open(task["ref"], "rb") as f:
+            return f.read()
+
+
+class ArchiveSource:
+    """
+    1 shard .zip / .tar / .tar.gz chứa <nhãn>/<ảnh>.
+    Mỗi luồng mở handle riêng. Với tar nén (.tar.gz) truy cập ngẫu nhiên phải giải nén lại từ đầu,
+    nên ảnh được đọc tuần tự 1 lần vào RAM khi list_tasks (phù hợp shard vài trăm MB).
+    """
+    def __init__(self, path, category_type=None):
+        self.path = path
+        self.category_type = category_type or os.path.splitext(os.path.basename(path))[0]
+        self.is_zip = zipfile.is_zipfile(path)
+        self._local = threading.local()
+        self._members = {} # Tar nén: tên member -> bytes
+
+    def _handle(self):
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = self._local.handle = zipfile.ZipFile(self.path) if self.is_zip else tarfile.open(self.path)
+        return handle
+
+    def list_tasks(self):
+        tasks = []
+        if self.is_zip:
+            names = [info.filename for info in self._handle().infolist() if not info.is_dir()]
+        else:
+            compressed = not self.path.lower().endswith(".tar")
+            names = []
+            with tarfile.open(self.path) as tar:
+                for member in tar:
+                    if member.isfile() and _is_image(member.name):
+                        names.append(member.name)
+                        if compressed:
+                            self._members[member.name] = tar.extractfile(member).read()
+        for name in names:
+            if _is_image(name):
+                tasks.append({"ref": name, "filename": os.path.basename(name), "actual_label": _label_from_path(name), "category_type": self.category_type})
+        return tasks
+
+    def read(self, task):
+        name = task["ref"]
+        if name in self._members:
+            return self._members[name]
+        handle = self._handle()
+        if self.is_zip:
+            return handle.read(name)
+        return handle.extractfile(name).read()
+
+
+class MinioPrefixSource:
+    """Ảnh trên MinIO dạng <prefix>/<nhãn>/<ảnh>"""
+    def __init__(self, client, bucket_name, prefix="", category_type=None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.category_type = category_type or (self.prefix.strip("/").split("/")[-1] or bucket_name)
+
+    def list_tasks(self):
+        tasks = []
+        for obj in self.client.list_objects(self.bucket_name, prefix=self.prefix, recursive=True):
+            if _is_image(obj.object_name):
+                tasks.append({"ref": obj.object_name, "filename": os.path.basename(obj.object_name), "actual_label": _label_from_path(obj.object_name), "category_type": self.category_type})
+        return tasks
+
+    def read(self, task):
+        response = self.client.get_object(self.bucket_name, task["ref"])
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+
+class DriveSource:
+    """
+    Folder Google Drive <root>/<base>/<sub>/<vpp>/<nhãn>/<ảnh> (cấu trúc cũ của batch_test).
+
+    - credentials_factory: hàm đọc / refresh credentials (có thể mở OAuth flow, ghi token.json);
+      chỉ gọi 1 lần dưới lock, mọi luồng dùng chung credentials đó.
+    - service_builder: hàm tạo Drive service từ credentials; mỗi luồng 1 service riêng (httplib2 không thread-safe)
+      thay vì dùng chung 1 service dưới 1 lock toàn cục.
+    - cache_path / cache_ttl: lưu danh sách file ra JSON để các lần chạy sau không phải quét lại Drive.
+    """
+    def __init__(self, credentials_factory, service_builder, root_id, folder_path, cache_path=None, cache_ttl=24 * 3600):
+        self.credentials_factory = credentials_factory
+        self.service_builder = service_builder
+        self.root_id = root_id
+        self.folder_path = list(folder_path)
+        self.category_type = self.folder_path[-1]
+        self.cache_path = cache_path
+        self.cache_ttl = cache_ttl
+        self._local = threading.local()
+        self._credentials = None
+        self._credentials_lock = threading.Lock()
+
+    def _get_credentials(self):
+        with self._credentials_lock:
+            if self._credentials is None:
+                self._credentials = self.credentials_factory()
+            return self._credentials
+
+    def _service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self.service_builder(self._get_credentials())
+        return service
+
+    def _list(self, query, fields="nextPageToken, files(id, name)"):
+        items, page_token = [], None
+        while True:
+            response = self._service().files().list(q=query, fields=fields, pageSize=1000, pageToken=page_token).execute()
+            items.extend(response.get("files", []))
+            page_token = response.get("nextPageToken")
+            if page_token is None:
+                return items
+
+    def _find_folder(self, name, parent_id):
+        folders = self._list(f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and '{parent_id}' in parents and trashed = false")
+        if not folders:
+            print(f"❌ [LỖI] Không tìm thấy folder '{name}' trong parent '{parent_id}'")
+            return None
+        return folders[0]["id"]
+
+    def list_tasks(self):
+        if self.cache_path and os.path.exists(self.cache_path) and time.time() - os.path.getmtime(self.cache_path) < self.cache_ttl:
+            with open(self.cache_path, encoding="utf-8") as f:
+                tasks = json.load(f)
+            print(f"📚 Dùng danh sách Drive đã cache ({len(tasks)} ảnh): {self.cache_path}")
+            return tasks
+
+        print("🔄 Đang định vị thư mục mục tiêu...")
+        folder_id = self.root_id
+        for name in self.folder_path:
+            folder_id = self._find_folder(name, folder_id)
+            if not folder_id:
+                return []
+        print(f"✅ Đã vào tới folder đích: {self.category_type} (ID: {folder_id})")
+
+        class_folders = self._list(f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false")
+        print(f"📂 Tìm thấy {len(class_folders)} class (nhãn). Đang quét ảnh...")
+
+        # Quét các folder class song song, mỗi luồng 1 service riêng
+        def scan(folder):
+            files = self._list(f"'{folder['id']}' in parents and trashed=false")
+            return [{"ref": f["id"], "filename": f["name"], "actual_label": folder["name"], "category_type": self.category_type} for f in files if _is_image(f["name"])]
+
+        tasks = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            for found in pool.map(scan, class_folders):
+                tasks.extend(found)
+
+        if self.cache_path:
+            with open(self.cache_path, "w", encoding="utf-8") as f:
+                json.dump(tasks, f, ensure_ascii=False)
+        return tasks
+
+    def read(self, task):
+        from googleapiclient.http import MediaIoBaseDownload # type:ignore
+        request = self._service().files().get_media(fileId=task["ref"])
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, request)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        return fh.getvalue()
+
+
+def prefetch(source, tasks, workers=8, depth=32):
+    """
+    Đọc ảnh song song bằng workers luồng, giữ tối đa depth ảnh đã tải chờ xử lý.
+    Yield (task, bytes) theo thứ tự tải xong; bytes = None nếu đọc lỗi.
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return
+    ready = queue.Queue(maxsize=max(1, depth))
+    pending = iter(tasks)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                task = next(pending, None)
+            if task is None:
+                return
+            try:
+                data = source.read(task)
+            except Exception as e:
+                print(f"  [LỖI] Không đọc được {task['filename']}: {e}")
+                data = None
+            ready.put((task, data)) # Chặn khi đã tải trước đủ depth ảnh
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(tasks))))]
+    for t in threads:
+        t.start()
+    for _ in range(len(tasks)):
+        yield ready.get()
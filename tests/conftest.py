@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Cho phép import package app khi chạy pytest từ bất kỳ thư mục nào
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,36 @@
+import io
+import tarfile
+import zipfile
+from app.core.archive import iter_archive_images
+
+
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+def _tar(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return buf
+
+
+def test_archive_members_above_limit_are_skipped():
+    members = {"a/small.jpg": b"x" * 10, "a/huge.jpg": b"\0" * 5000, "notes.txt": b"y"}
+    for fileobj, filename in ((_zip(members), "batch.zip"), (_tar(members), "batch.tar.gz")):
+        images = list(iter_archive_images(fileobj, filename, max_member_bytes=100))
+        assert images == [("small.jpg", b"x" * 10)]
+
+
+def test_archive_without_limit_reads_everything():
+    members = {"small.jpg": b"x", "huge.jpg": b"\0" * 5000}
+    assert len(list(iter_archive_images(_zip(members), "batch.zip"))) == 2
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from async_engine import AIMDLimiter # noqa: E402
+
+
+async def _simulate(latency_fn, requests=2000, **config):
+    """Gọi acquire/release tuần tự (không cần mạng), latency lấy từ latency_fn(limiter)"""
+    limiter = AIMDLimiter(initial=2, max_limit=32, cooldown=0.0, **config)
+    for _ in range(requests):
+        await limiter.acquire()
+        await limiter.release(latency_fn(limiter))
+    return limiter
+
+
+def test_heterogeneous_latencies_do_not_pin_limit():
+    rng = random.Random(0)
+    # Server chưa bão hòa: ảnh nhỏ ~30ms lẫn ảnh 12MP ~150ms, latency không phụ thuộc concurrency
+    limiter = asyncio.run(_simulate(lambda _: rng.choice((0.03, 0.15)) * rng.uniform(0.9, 1.1)))
+    assert limiter.limit == 32
+    assert limiter.stats["decreases"] <= 5
+
+
+def test_uniform_latencies_reach_max_limit():
+    rng = random.Random(1)
+    limiter = asyncio.run(_simulate(lambda _: rng.uniform(0.09, 0.11)))
+    assert limiter.limit == 32
+    assert limiter.stats["decreases"] == 0
+
+
+def test_queueing_latency_backs_off():
+    rng = random.Random(2)
+    # Server chỉ xử lý song song được 8 request: vượt quá thì latency tăng theo độ dài hàng đợi
+    def latency(limiter):
+        return rng.choice((0.03, 0.15)) * max(1.0, limiter.limit / 8)
+    limiter = asyncio.run(_simulate(latency))
+    assert limiter.stats["decreases"] > 0
+    assert limiter.stats["peak_limit"] < 32
+
+
+def test_overload_signal_halves_limit():
+    async def run():
+        limiter = AIMDLimiter(initial=16, max_limit=32, cooldown=0.0)
+        await limiter.acquire()
+        await limiter.release(None, overloaded=True)
+        return limiter
+    assert asyncio.run(run()).limit == 8
@@ -0,0 +1,119 @@
+import numpy as np #type: ignore
+from app.core.backends import _InputBufferPool, _LetterboxBackend
+from app.core.filter import ImageFilter
+
+
+class _FakeOnnxBackend(_LetterboxBackend):
+    """Backend letterbox với _run giả: mỗi ảnh 1 box class 0 ở giữa khung 640x640"""
+    names = {0: "pen", 1: "cup"}
+
+    def _run(self, batch):
+        output = np.zeros((len(batch), 6, 10), dtype=np.float32)
+        output[:, :4, 0] = (320, 320, 100, 100)
+        output[:, 4, 0] = 0.9
+        return output
+
+
+def _make_filter(backend):
+    return ImageFilter(None, None, None, None, ["pen"], None, log_handler=lambda **kwargs: None, device="cpu", backend=backend)
+
+
+def test_buffer_pool_reuses_buffers_not_first_in_free_list():
+    pool = _InputBufferPool(8, max_free=2)
+    small, large = pool.acquire(1), pool.acquire(4)
+    pool.release(large)
+    pool.release(small)
+    # Buffer vừa nhất (small) nằm sau large trong danh sách free
+    assert pool.acquire(1) is small
+    pool.release(small)
+    large, extra = pool.acquire(4), pool.acquire(3)  # extra là buffer mới
+    pool.release(large)
+    pool.release(extra)  # vượt max_free -> bỏ buffer nhỏ nhất (small)
+    assert len(pool._free) == 2
+    assert all(len(buf[0]) >= 3 for buf in pool._free)
+
+
+def test_sequential_predict_batch_with_varying_batch_sizes():
+    tool = _make_filter(_FakeOnnxBackend())
+    try:
+        for n in (2, 1, 3, 1, 2):
+            images = [np.full((480, 640, 3), 127, dtype=np.uint8) for _ in range(n)]
+            results = tool.predict_batch(images)
+            assert len(results) == n
+            for detections in results:
+                assert [d["object"] for d in detections] == ["pen"]
+                assert detections[0]["box"] == [270.0, 190.0, 370.0, 290.0]
+    finally:
+        tool.close()
+
+
+class _StaticBatchYolo:
+    """Giả lập wrapper YOLO của model export batch cố định: báo lỗi nếu số ảnh khác batch"""
+    def __init__(self, batch):
+        self.batch = batch
+        self.calls = []
+
+    def __call__(self, images, **kwargs):
+        if len(images) != self.batch:
+            raise RuntimeError(f"expected batch {self.batch}, got {len(images)}")
+        self.calls.append((len(images), kwargs))
+        boxes = type("Boxes", (), {"data": type("T", (), {"cpu": lambda s: s, "numpy": lambda s: np.zeros((0, 6), np.float32)})()})
+        return [type("R", (), {"boxes": boxes})() for _ in images]
+
+
+def _ultralytics_backend(static_batch):
+    from app.core.backends import UltralyticsBackend
+    backend = UltralyticsBackend.__new__(UltralyticsBackend)
+    backend.model = _StaticBatchYolo(static_batch or 5)
+    backend.device = "cpu"
+    backend.names = None
+    backend.static_batch = static_batch
+    return backend
+
+
+def test_ultralytics_static_batch_runs_in_chunks():
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    backend = _ultralytics_backend(1)
+    assert len(backend.predict([image] * 5)) == 5
+    assert [n for n, _ in backend.model.calls] == [1] * 5
+
+    backend = _ultralytics_backend(4)
+    assert len(backend.predict([image] * 5)) == 5
+    assert [n for n, _ in backend.model.calls] == [4, 4]
+
+
+def test_static_batch_size_reads_onnx_input(tmp_path):
+    onnx = __import__("pytest").importorskip("onnx")
+    from onnx import helper, TensorProto
+    from app.core.backends import _static_batch_size
+
+    def export(batch, path):
+        x = helper.make_tensor_value_info("images", TensorProto.FLOAT, [batch, 3, 64, 64])
+        y = helper.make_tensor_value_info("out", TensorProto.FLOAT, [batch, 3, 64, 64])
+        graph = helper.make_graph([helper.make_node("Identity", ["images"], ["out"])], "g", [x], [y])
+        onnx.save(helper.make_model(graph), str(path))
+        return str(path)
+
+    assert _static_batch_size(export(1, tmp_path / "static.onnx")) == 1
+    assert _static_batch_size(export("batch", tmp_path / "dynamic.onnx")) is None
+    assert _static_batch_size("yolov8n.pt") is None
+    assert _static_batch_size("yolov8n.engine") == 1
+
+
+def test_max_batch_size_follows_batch_config():
+    assert _make_filter(_FakeOnnxBackend()).max_batch_size == 1
+    tool = ImageFilter(None, None, None, None, ["pen"], None, log_handler=lambda **kwargs: None, device="cpu",
+                       backend=_FakeOnnxBackend(), batch_config={"max_batch_size": 4}, warmup=False)
+    try:
+        assert tool.max_batch_size == 4
+    finally:
+        tool.close()
+
+
+def test_ultralytics_keeps_its_default_iou_unless_set():
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    backend = _ultralytics_backend(1)
+    backend.predict([image])
+    backend.predict([image], iou=0.5)
+    assert "iou" not in backend.model.calls[0][1]
+    assert backend.model.calls[1][1]["iou"] == 0.5
@@ -0,0 +1,29 @@
+import numpy as np #type: ignore
+import pytest #type: ignore
+from app.core.cascade import CascadeGate
+
+
+def _white_background_product():
+    """Ảnh sản phẩm chụp nền trắng: vật nhỏ màu nhạt ở giữa, còn lại toàn nền trắng"""
+    img = np.full((480, 480, 3), 245, dtype=np.uint8)
+    img[200:280, 180:300] = (200, 205, 210)
+    return img
+
+
+def test_heuristics_are_off_by_default():
+    gate = CascadeGate()
+    result = gate.check(_white_background_product())
+    assert not result["rejected"]
+    assert gate.get_stats()["passed"] == 1
+
+
+def test_heuristics_opt_in_rejects_blank_image():
+    gate = CascadeGate(heuristics=True)
+    result = gate.check(np.full((100, 100, 3), 128, dtype=np.uint8))
+    assert result["rejected"] and result["reason"] == "Blank Image"
+
+
+def test_invalid_reject_action_is_rejected():
+    with pytest.raises(ValueError):
+        CascadeGate(reject_action="DROP")
+    assert CascadeGate(reject_action="unprocessed").reject_action == "UNPROCESSED"
@@ -0,0 +1,36 @@
+import random
+from app.core.dedup import MultiIndexHash, NearDuplicateIndex, hamming
+
+
+def _flip(h, count, rng):
+    for bit in rng.sample(range(64), count):
+        h ^= 1 << bit
+    return h
+
+
+def test_multi_index_matches_brute_force():
+    rng = random.Random(0)
+    index = MultiIndexHash(max_distance=6)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    for _ in range(300):
+        query = _flip(rng.choice(hashes), rng.randint(0, 9), rng)
+        expected = min((hamming(query, h) for h in hashes), default=None)
+        found = index.search(query)
+        if expected is not None and expected <= 6:
+            assert found is not None and found[0] == expected
+        else:
+            assert found is None
+
+
+def test_index_evicts_oldest_items():
+    index = NearDuplicateIndex(threshold=4, max_items=3)
+    hashes = [0xFF << shift for shift in (0, 16, 32, 48)]
+    for h in hashes:
+        index.add(h, {"filename": str(h)})
+    assert index.lookup(hashes[0]) is None
+    assert index.lookup(hashes[3]) == (0, {"filename": str(hashes[3])})
+    assert index.lookup(hashes[2] ^ 1)[0] == 1
+    stats = index.get_stats()
+    assert stats["size"] == 3 and stats["evictions"] == 1
@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2 #type: ignore
+import numpy as np #type: ignore
+from app.core.filter import ImageFilter
+from app.core.metrics import RESULT_CACHE_TOTAL
+
+
+class _OverlapBackend:
+    """Backend giả ghi lại số lần predict chạy chồng lên nhau"""
+    names = {0: "pen", 1: "cup"}
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def predict(self, images, conf=0.1, iou=0.45, classes=None, max_det=300):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.calls.append(len(images))
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return [np.array([[1.0, 2.0, 30.0, 40.0, 0.9, 0]], np.float32) for _ in images]
+
+
+def _jpeg(seed, h=64, w=64):
+    rng = np.random.default_rng(seed)
+    return cv2.imencode(".jpg", rng.integers(0, 255, (h, w, 3), dtype=np.uint8))[1].tobytes()
+
+
+def _make_filter(backend, **kwargs):
+    return ImageFilter(None, None, None, None, ["pen"], None, log_handler=lambda **kw: None, device="cpu", backend=backend, warmup=False, **kwargs)
+
+
+def test_concurrent_requests_without_batcher_call_model_serially():
+    backend = _OverlapBackend()
+    tool = _make_filter(backend)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda i: tool.process(_jpeg(i)), range(16)))
+        assert all(action == "KEEP" for _, _, _, action in results)
+        assert backend.max_active == 1
+    finally:
+        tool.close()
+
+
+def test_concurrent_process_batch_goes_through_batcher():
+    backend = _OverlapBackend()
+    tool = _make_filter(backend, batch_config={"max_batch_size": 4, "max_wait_ms": 5})
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            batches = list(pool.map(lambda i: tool.process_batch([_jpeg(i * 10 + k) for k in range(6)]), range(4)))
+        assert all(action == "KEEP" for results in batches for _, _, _, action in results)
+        assert backend.max_active == 1
+        assert max(backend.calls) <= 4
+        assert tool.batcher.stats["images"] == 24
+    finally:
+        tool.close()
+
+
+def test_client_receives_raw_model_label_names():
+    backend = _OverlapBackend()
+    backend.names = {0: "scissors"}
+    tool = _make_filter(backend)
+    tool.target_classes = tool.labels.normalize_targets(["scissor"])
+    try:
+        is_valid, labels, details, action = tool.process(_jpeg(0))
+        assert action == "KEEP" and is_valid
+        assert labels == ["scissors"]
+        assert details[0]["object"] == "scissors"
+    finally:
+        tool.close()
+
+
+class _MixedBackend(_OverlapBackend):
+    """1 box target (pen) + 1 box không phải target (car)"""
+    names = {0: "pen", 1: "car"}
+
+    def predict(self, images, conf=0.1, iou=0.45, classes=None, max_det=300):
+        dets = np.array([[1.0, 2.0, 30.0, 40.0, 0.9, 0], [5.0, 5.0, 20.0, 20.0, 0.8, 1]], np.float32)
+        if classes is not None:
+            dets = dets[np.isin(dets[:, 5].astype(np.int64), classes)]
+        return [dets for _ in images]
+
+
+def test_decision_mode_duplicate_hit_returns_targets_only():
+    tool = _make_filter(_MixedBackend(), dedup_config={"threshold": 6})
+    try:
+        image = _jpeg(7, 128, 128)
+        _, labels, _, action = tool.process(image, metadata={"filename": "a.jpg"})
+        assert action == "KEEP" and sorted(labels) == ["car", "pen"]
+
+        # Cùng ảnh gửi lại ở chế độ decision -> trúng chỉ mục trùng lặp
+        _, labels, details, action = tool.process(image, metadata={"filename": "b.jpg"}, mode="decision")
+        assert action == "KEEP"
+        assert labels == ["pen"]
+        assert details == [{"object": "pen", "class_id": 0}]
+    finally:
+        tool.close()
+
+
+def test_cache_hit_does_not_upload_image_again():
+    uploads, logs = [], []
+    tool = ImageFilter(None, None, None, None, ["pen"], None, image_handler=lambda data, name: uploads.append(name) or name,
+                       log_handler=lambda **kw: logs.append(kw), device="cpu", backend=_MixedBackend(), warmup=False, cache_config={"max_items": 10})
+    try:
+        hits_before = RESULT_CACHE_TOTAL.value(event="hit")
+        image = _jpeg(3)
+        for name in ("a.jpg", "b.jpg"):
+            _, _, _, action = tool.process(image, metadata={"filename": name})
+            assert action == "KEEP"
+        assert uploads == ["keep/a.jpg"]
+        assert logs[1]["cache_hit"] is True and logs[1]["minio_object_name"] is None
+        assert RESULT_CACHE_TOTAL.value(event="hit") == hits_before + 1
+    finally:
+        tool.close()
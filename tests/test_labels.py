@@ -0,0 +1,27 @@
+import numpy as np #type: ignore
+from app.core.labels import LabelSpace
+
+
+def test_labels_of_returns_raw_model_names():
+    labels = LabelSpace({0: "scissors", 1: "paper note", 2: "cup"})
+    assert labels.labels_of(np.array([0, 1, 2])) == ["scissors", "paper note", "cup"]
+
+
+def test_match_uses_canonical_names():
+    labels = LabelSpace({0: "scissors", 1: "paper note", 2: "cup"})
+    targets = labels.normalize_targets(["Scissor", "giấy note"])
+    assert labels.match(np.array([0, 2]), targets) == ["scissor"]
+    assert labels.match(np.array([1]), targets) == ["note paper"]
+    assert labels.match(np.array([2]), targets) == []
+
+
+def test_class_ids_of_falls_back_to_names():
+    labels = LabelSpace({0: "scissors", 1: "paper note", 2: "cup"})
+    detections = [{"object": "cup", "class_id": 2}, {"object": "Paper_Note"}, {"object": "unknown"}]
+    assert labels.class_ids_of(detections).tolist() == [2, 1]
+
+
+def test_match_grows_table_for_unseen_ids():
+    labels = LabelSpace({0: "cup"})
+    assert labels.match(np.array([0, 5]), labels.normalize_targets(["cup"])) == ["cup"]
+    assert labels.num_classes == 6
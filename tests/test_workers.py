@@ -0,0 +1,43 @@
+from multiprocessing.shared_memory import SharedMemory
+import pytest #type: ignore
+from app.core import workers
+
+
+def _exists(name):
+    try:
+        shm = SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def test_retired_slot_is_replaced_with_new_memory():
+    pool = workers._SlotPool(1, 1024)
+    try:
+        shm, index = pool.acquire(10)
+        old_name = shm.name
+        pool.retire(shm, index)
+        assert not _exists(old_name)
+        new_shm, new_index = pool.acquire(10)
+        assert new_index == index and new_shm.name != old_name
+        pool.release(new_shm, new_index)
+    finally:
+        pool.close()
+
+
+def test_worker_ready_timeout_cleans_up(monkeypatch):
+    created = []
+
+    class _RecordingSlotPool(workers._SlotPool):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(workers, "_SlotPool", _RecordingSlotPool)
+    pool = workers.InferencePool.__new__(workers.InferencePool)
+    with pytest.raises(RuntimeError):
+        # Process spawn không thể sẵn sàng trong 1ms -> hết thời gian chờ
+        workers.InferencePool.__init__(pool, "onnxruntime", "missing.onnx", num_workers=1, slot_bytes=1024, timeout=0.001)
+    assert created and not any(_exists(shm.name) for shm in created[0].slots)
+    assert not any(process.is_alive() for process in pool._processes)